@@ -0,0 +1,242 @@
+"""
+Whole-run aggregation over the chunks of a source.
+Accumulators are filled per chunk and can be merged, so chunks are
+processed independently on a worker pool and only one chunk per worker
+plus the fixed size accumulators are held in memory at any time.
+"""
+import numpy as np
+
+# glyph kinds in plot_templates.json that are computed with this module
+kinds = ("hist", "hist2d")
+
+
+def finite(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values[np.isfinite(values)]
+
+
+class Summary:
+    """
+    Count, mean, variance (Chan et al. parallel algorithm), min and max.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = finite(values)
+        if not len(values):
+            return
+        other = Summary()
+        other.count = len(values)
+        other.mean = values.mean()
+        other.m2 = ((values - other.mean)**2).sum()
+        other.min = values.min()
+        other.max = values.max()
+        self.merge(other)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta*other.count/count
+        self.m2 += other.m2 + delta**2*self.count*other.count/count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2/self.count) if self.count else np.nan
+
+
+class Reservoir:
+    """
+    Fixed size uniform sample of all values seen, used for quantiles.
+    """
+
+    def __init__(self, size=10000, seed=None):
+        self.size = size
+        self.seen = 0
+        self.sample = np.empty(0)
+        self.rng = np.random.RandomState(seed)
+
+    def add(self, values):
+        other = Reservoir(self.size)
+        values = finite(values)
+        other.seen = len(values)
+        if len(values) > self.size:
+            values = values[self.rng.choice(len(values), self.size, replace=False)]
+        other.sample = values
+        self.merge(other)
+
+    def merge(self, other):
+        seen = self.seen + other.seen
+        if not seen:
+            return
+        k = min(self.size, len(self.sample) + len(other.sample))
+        # take from each side in proportion to the number of values it represents
+        n_self = min(self.rng.binomial(k, self.seen/seen), len(self.sample))
+        n_other = min(k - n_self, len(other.sample))
+        n_self = min(k - n_other, len(self.sample))
+        self.sample = np.concatenate([
+            self.rng.choice(self.sample, n_self, replace=False),
+            self.rng.choice(other.sample, n_other, replace=False),
+        ])
+        self.seen = seen
+
+    def quantiles(self, qs):
+        if not len(self.sample):
+            return np.full(len(qs), np.nan)
+        return np.quantile(self.sample, qs)
+
+
+class Histogram1D:
+    """
+    Counts on fixed edges, values outside are kept as under/overflow.
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges)-1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, values):
+        values = finite(values)
+        self.counts += np.histogram(values, bins=self.edges)[0]
+        self.underflow += int((values < self.edges[0]).sum())
+        self.overflow += int((values > self.edges[-1]).sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class Histogram2D:
+    """
+    Counts on a fixed (x, y) grid, values outside are dropped and counted.
+    """
+
+    def __init__(self, xedges, yedges):
+        self.xedges = np.asarray(xedges, dtype=np.float64)
+        self.yedges = np.asarray(yedges, dtype=np.float64)
+        self.counts = np.zeros((len(self.xedges)-1, len(self.yedges)-1), dtype=np.int64)
+        self.outside = 0
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        mask = np.isfinite(x) & np.isfinite(y)
+        counts = np.histogram2d(x[mask], y[mask], bins=(self.xedges, self.yedges))[0]
+        self.counts += counts.astype(np.int64)
+        self.outside += int(mask.sum() - counts.sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.outside += other.outside
+
+
+def edges_for(values, bins, value_range=None):
+    '''
+    Bin edges from an explicit range or the finite range of values.
+    '''
+    if value_range is None:
+        values = finite(values)
+        value_range = (values.min(), values.max()) if len(values) else (0., 1.)
+    lo, hi = value_range
+    if lo == hi:
+        lo, hi = lo-0.5, hi+0.5
+    return np.linspace(lo, hi, bins+1)
+
+
+class ColumnAggregate:
+    """
+    Summary, quantile sample and (optionally) histogram of one or two columns.
+    """
+
+    def __init__(self, columns, edges, reservoir_size=10000, cut=None):
+        self.columns = columns
+        self.cut = cut
+        self.summaries = {c: Summary() for c in columns}
+        self.reservoirs = {c: Reservoir(reservoir_size) for c in columns}
+        if len(columns) == 1:
+            self.histogram = Histogram1D(edges[0])
+        else:
+            self.histogram = Histogram2D(*edges)
+        self.chunks = 0
+
+    def empty(self):
+        return ColumnAggregate(self.columns, self._edges(), self.reservoirs[self.columns[0]].size, self.cut)
+
+    def _edges(self):
+        if isinstance(self.histogram, Histogram1D):
+            return [self.histogram.edges]
+        return [self.histogram.xedges, self.histogram.yedges]
+
+    def add(self, chunk):
+        values = [chunk[c] for c in self.columns]
+        if self.cut is not None and self.cut.applies_to(chunk):
+            mask = self.cut.mask(chunk)
+            values = [v[mask] for v in values]
+        for c, v in zip(self.columns, values):
+            self.summaries[c].add(v)
+            self.reservoirs[c].add(v)
+        self.histogram.add(*values)
+        self.chunks += 1
+
+    def merge(self, other):
+        for c in self.columns:
+            self.summaries[c].merge(other.summaries[c])
+            self.reservoirs[c].merge(other.reservoirs[c])
+        self.histogram.merge(other.histogram)
+        self.chunks += other.chunks
+
+    def describe(self, qs=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        lines = []
+        for c in self.columns:
+            s = self.summaries[c]
+            quantiles = ", ".join("{:.0%}: {:.4g}".format(q, v) for q, v in zip(qs, self.reservoirs[c].quantiles(qs)))
+            lines.append("{}: n={} mean={:.4g} std={:.4g} min={:.4g} max={:.4g} | {}".format(
+                c, s.count, s.mean, s.std, s.min, s.max, quantiles))
+        return "\n".join(lines)
+
+
+def aggregate_chunks(chunks, aggregate, executor=None, window=4, progress=None, cancel=None):
+    '''
+    Fold every chunk of the iterable into `aggregate`, processing up to
+    `window` chunks at a time on the executor. progress(aggregate) is called
+    after every merged chunk, setting the cancel event stops early.
+    '''
+    def partial_aggregate(chunk):
+        part = aggregate.empty()
+        part.add(chunk)
+        return part
+
+    pending = []
+    for chunk in chunks:
+        if cancel is not None and cancel.is_set():
+            break
+        if executor is None:
+            aggregate.merge(partial_aggregate(chunk))
+        else:
+            pending.append(executor.submit(partial_aggregate, chunk))
+            if len(pending) < window:
+                continue
+            aggregate.merge(pending.pop(0).result())
+        if progress is not None:
+            progress(aggregate)
+    for future in pending:
+        if cancel is not None and cancel.is_set():
+            future.cancel()
+            continue
+        aggregate.merge(future.result())
+        if progress is not None:
+            progress(aggregate)
+    return aggregate
@@ -0,0 +1,320 @@
+"""
+Benchmarks of the server side hot paths, on data generated by fakeclient.py
+so no strax server is needed:
+
+    python straxui/benchmark.py --output before.json
+    python straxui/benchmark.py --compare before.json --only plot
+
+Data comes from fixed seeds and every benchmark reports the median and
+minimum of several repeats after a warmup, so results of two commits run
+on the same machine can be compared. The JSON output records the commit,
+library versions, sizes and STRAXUI_* settings next to the timings.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from os.path import dirname, join, abspath
+
+import numpy as np
+import bokeh
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.document import Document
+from bokeh.server.callbacks import NextTickCallback
+
+# a benchmark must not read runs cached on disk by an earlier invocation
+os.environ.pop("STRAXUI_DISK_CACHE", None)
+# sessions started from main.py use the default client
+os.environ["STRAXRPC_ADDR"] = "fake"
+
+from fakeclient import FakeStraxClient
+from datalayer import get_data_layer, shutdown_data_layer
+from chunks import Chunk
+from table import TableView
+from pages import PlotColumnsPage
+import derived
+
+
+def measure(func, setup=None, repeat=5, warmup=1):
+    '''
+    Median, minimum and maximum wall time of func() in seconds.
+    setup() runs before every call and is not timed.
+    '''
+    times = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {"median": float(np.median(times)), "min": min(times), "max": max(times), "repeat": repeat}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=dirname(abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_next_ticks(doc):
+    '''
+    Run the next tick callbacks of a document, there is no server loop to do it.
+    '''
+    for callback in list(doc.session_callbacks):
+        if isinstance(callback, NextTickCallback):
+            doc.remove_next_tick_callback(callback)
+            callback.callback()
+
+
+def session_state(data_layer, ctx):
+    '''
+    The shared state main.py builds for a session, on a document without a server.
+    '''
+    with open(join(dirname(abspath(__file__)), "data", "plot_templates.json"), "rb") as f:
+        plot_templates = {t["name"]: t for t in json.load(f)}
+    doc = Document()
+    return {
+        "executor": data_layer.ui_executor,
+        "doc": doc,
+        "session_id": str(id(doc)),
+        "dataframe_names": ctx.search_dataframe_names("*"),
+        "strax_ctx": ctx,
+        "plot_templates": plot_templates,
+        "sources": data_layer.cache,
+        "data_layer": data_layer,
+        "selection": None,
+        "set_selection": lambda selection: None,
+        "update_pages": lambda: None,
+    }
+
+
+class Benchmarks:
+    """
+    Every bench_* method returns a dict of results, timings in seconds.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.ctx = FakeStraxClient("fake", rows=args.rows, chunks=args.chunks, samples=args.samples)
+        self.data_layer = get_data_layer()
+        self.run_id = "bench"
+
+    def load(self, dfname, run_id=None):
+        '''
+        Load a source through the data layer, like the Load button does, and wait for it.
+        '''
+        run_id = run_id or self.run_id
+        load = self.data_layer.load(self.ctx, run_id, dfname)
+        load.done.wait()
+        if load.error is not None:
+            raise load.error
+        return self.data_layer.cache[load.name]
+
+    def unload(self, dfname, run_id=None):
+        self.data_layer.cache.remove(self.data_layer.source_name(self.ctx.addr, dfname, run_id or self.run_id))
+
+    def timed(self, func, setup=None, rows=None):
+        result = measure(func, setup, repeat=self.args.repeat, warmup=self.args.warmup)
+        if rows:
+            result["rows"] = rows
+            result["rows_per_s"] = rows/result["median"]
+        return result
+
+    def bench_ingest_events(self):
+        rows = self.args.rows*self.args.chunks
+        return self.timed(lambda: self.load("event_basics"), lambda: self.unload("event_basics"), rows)
+
+    def bench_ingest_peaks(self):
+        rows = self.args.rows*self.args.chunks
+        return self.timed(lambda: self.load("peaks"), lambda: self.unload("peaks"), rows)
+
+    def bench_derived_columns(self):
+        arrays = [chunk.array for chunk in self.load("peaks")]
+        names = [derived.derived_name(r, "data") for r in derived.enabled_reductions()]
+        def compute():
+            for arr in arrays:
+                chunk = Chunk(arr)
+                for name in names:
+                    chunk[name]
+        return self.timed(compute, rows=sum(len(a) for a in arrays))
+
+    def plot_page(self, template, source, values):
+        page = PlotColumnsPage(session_state(self.data_layer, self.ctx))
+        page.create_page()
+        page.refresh()
+        page.plot_template_selector.value = template
+        page.src_selector.value = source
+        for selector, value in zip(page.column_selectors, values):
+            selector.value = value
+        page.shared_state["doc"].add_root(page.plot_layout)
+        return page
+
+    def plot(self, page):
+        '''
+        Build the plot, wait for downsampling on the executor and serialize
+        the document, which is most of the cost of a push.
+        '''
+        page.build_plot()
+        doc = page.shared_state["doc"]
+        for glyph in page.downsampled:
+            if glyph.future is not None:
+                glyph.future.result()
+        run_next_ticks(doc)
+        doc.to_json_string()
+
+    def bench_plot_scatter(self):
+        srcs = self.load("event_basics")
+        page = self.plot_page("Scalar Values", srcs.name, ["cs1", "cs2"])
+        return self.timed(lambda: self.plot(page), rows=len(srcs[0]))
+
+    def bench_plot_waveforms(self):
+        srcs = self.load("peaks")
+        page = self.plot_page("Array Values", srcs.name, ["index(data)", "data"])
+        return self.timed(lambda: self.plot(page), rows=len(srcs[0]))
+
+    def bench_plot_packed_waveforms(self):
+        srcs = self.load("peaks")
+        page = self.plot_page("Waveforms", srcs.name, ["data"])
+        return self.timed(lambda: self.plot(page), rows=len(srcs[0]))
+
+    def bench_table_pages(self):
+        chunk = self.load("event_basics")[0]
+        view = TableView()
+        names = [n for n in chunk.fields if chunk.kind(n) == "scalar"]
+        pages = min(self.args.pages, max(1, len(chunk)//view.page_size))
+        def paginate():
+            view.set_chunk(chunk)
+            view.sort("cs1", ascending=False)
+            view.set_filter("cs2", low=10.)
+            for number in range(min(pages, view.n_pages)):
+                view.page(number, names)
+        return self.timed(paginate, rows=pages*view.page_size)
+
+    def bench_concurrent_sessions(self):
+        '''
+        Sessions loading different runs at the same time, each then paging through a table.
+        '''
+        sessions = self.args.sessions
+        run_ids = ["bench_session_{}".format(i) for i in range(sessions)]
+        def session(run_id, errors):
+            try:
+                chunk = self.load("event_basics", run_id)[0]
+                view = TableView()
+                view.set_chunk(chunk)
+                view.sort("cs1")
+                for number in range(min(10, view.n_pages)):
+                    view.page(number, ["time", "cs1", "cs2"])
+            except Exception as e:
+                errors.append(e)
+        def run():
+            errors = []
+            threads = [threading.Thread(target=session, args=(r, errors)) for r in run_ids]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+        def unload():
+            for run_id in run_ids:
+                self.unload("event_basics", run_id)
+        result = self.timed(run, unload, rows=sessions*self.args.rows*self.args.chunks)
+        result["sessions"] = sessions
+        return result
+
+    def bench_session_startup(self):
+        '''
+        A new session: main.py building the shell, then the first tab on the next tick.
+        '''
+        app = Application(DirectoryHandler(filename=dirname(abspath(__file__))))
+        def session():
+            doc = app.create_document()
+            for handler in app.handlers:
+                if handler.failed:
+                    raise RuntimeError(handler.error)
+            run_next_ticks(doc)
+            self.data_layer.release_session(str(id(doc)))
+        return self.timed(session)
+
+    def names(self):
+        return [n[len("bench_"):] for n in dir(self) if n.startswith("bench_")]
+
+    def run(self, only=()):
+        results = {}
+        for name in self.names():
+            if only and not any(o in name for o in only):
+                continue
+            results[name] = getattr(self, "bench_" + name)()
+            print("{:20} median {:8.4f} s  min {:8.4f} s".format(name, results[name]["median"], results[name]["min"]))
+        return results
+
+    def close(self):
+        shutdown_data_layer()
+
+
+def compare(results, previous):
+    print("\n{:20} {:>10} {:>10} {:>8}".format("benchmark", "before", "after", "ratio"))
+    for name, result in results.items():
+        if name not in previous["results"]:
+            continue
+        before = previous["results"][name]["median"]
+        print("{:20} {:10.4f} {:10.4f} {:8.2f}".format(name, before, result["median"], result["median"]/before))
+
+
+def vars_without_output(args):
+    return {k: v for k, v in args.items() if k not in ("output", "compare", "only")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark straxui on generated data")
+    parser.add_argument("--rows", type=int, default=20000, help="rows per chunk")
+    parser.add_argument("--chunks", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=200, help="samples of waveform fields")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--pages", type=int, default=50, help="table pages to read")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", action="append", default=[], help="run benchmarks containing this text")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks(args)
+    try:
+        results = benchmarks.run(args.only)
+    finally:
+        benchmarks.close()
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "bokeh": bokeh.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "parameters": vars_without_output(vars(args)),
+        "environment": {k: v for k, v in os.environ.items() if k.startswith("STRAXUI_")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous["parameters"] != report["parameters"]:
+            print("\nwarning: {} was run with different parameters".format(args.compare))
+        compare(results, previous)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Bounded in-memory store for loaded chunks.
+Sources are named "{dfname}_{run_id}" and hold a list of chunks.
+When the byte budget is exceeded, chunks of the least valuable source
+are evicted and (optionally) spilled to .npy files, from which they are
+memory mapped again the next time they are touched.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from chunks import Chunk
+from schema import SourceSchema, ColumnInfo
+from expressions import ExpressionError
+
+
+class ChunkEvicted(KeyError):
+    pass
+
+
+class _Entry:
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.nbytes = chunk.nbytes
+        self.path = None
+        self.spilled_bytes = 0
+        self.last_access = time.monotonic()
+
+
+class _SourceStats:
+    def __init__(self):
+        self.hits = 0
+        self.last_access = time.monotonic()
+
+
+class SourceView:
+    """
+    List-like view of the chunks of a single source.
+    """
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    def __len__(self):
+        return self.cache.count(self.name)
+
+    def __getitem__(self, idx):
+        return self.cache.get(self.name, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @property
+    def schema(self):
+        return self.cache.schema(self.name)
+
+    def append(self, chunk):
+        self.cache.append(self.name, chunk)
+
+
+class ChunkCache:
+    """
+    Thread safe, memory accounted chunk store with LRU/LFU eviction per source.
+    """
+    policies = ("lru", "lfu")
+
+    def __init__(self, max_bytes, policy="lru", spill_dir=None):
+        if policy not in self.policies:
+            raise ValueError("Unknown eviction policy {}".format(policy))
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spilled_bytes = 0
+        self._sources = {}
+        self._stats = {}
+        self._schemas = {}
+        self._expressions = {}
+        self._pinned = set()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_environ(cls):
+        max_bytes = int(float(os.environ.get("STRAXUI_CACHE_MB", 2000))*1e6)
+        policy = os.environ.get("STRAXUI_CACHE_POLICY", "lru")
+        spill_dir = None
+        if os.environ.get("STRAXUI_CACHE_SPILL", "1") != "0":
+            spill_dir = tempfile.mkdtemp(prefix="straxui_spill_", dir=os.environ.get("STRAXUI_SPILL_DIR"))
+        return cls(max_bytes, policy=policy, spill_dir=spill_dir)
+
+    def __getitem__(self, name):
+        return SourceView(self, name)
+
+    def __contains__(self, name):
+        return name in self._sources
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, name, idx=None):
+        '''
+        With idx returns a single chunk, reloading it if it was evicted.
+        Without idx returns the source view or None for unknown sources.
+        '''
+        if idx is None:
+            return SourceView(self, name) if name in self._sources else None
+        with self._lock:
+            entries = self._sources[name]
+            entry = entries[idx]
+            stats = self._stats[name]
+            stats.hits += 1
+            stats.last_access = entry.last_access = time.monotonic()
+            if entry.chunk is None:
+                self.misses += 1
+                entry.chunk = self._reload(name, entry)
+                self.nbytes += entry.nbytes
+            else:
+                self.hits += 1
+                # derived columns may have been added since the last access
+                nbytes = entry.chunk.nbytes
+                self.nbytes += nbytes - entry.nbytes
+                entry.nbytes = nbytes
+            chunk = entry.chunk
+            self._evict(keep=entry)
+            return chunk
+
+    def keys(self):
+        return list(self._sources)
+
+    def count(self, name):
+        return len(self._sources.get(name, []))
+
+    def append(self, name, chunk):
+        with self._lock:
+            for column, expression in self._expressions.get(name, {}).items():
+                chunk.add_expression(column, expression)
+            entry = _Entry(chunk)
+            self._sources.setdefault(name, []).append(entry)
+            self._stats.setdefault(name, _SourceStats()).last_access = entry.last_access
+            self._schemas.setdefault(name, SourceSchema()).merge(chunk.schema)
+            self.nbytes += entry.nbytes
+            self._evict(keep=entry)
+
+    def schema(self, name):
+        '''
+        Merged schema of all chunks of a source, kept even while chunks are evicted.
+        '''
+        with self._lock:
+            return self._schemas.get(name)
+
+    def add_expression(self, name, column, expression):
+        '''
+        Add a column defined by an expression to every chunk of a source,
+        including chunks appended or reloaded later. Values are computed per
+        chunk when first requested and accounted like derived columns.
+        The cache is shared by all sessions, so a defined column can not be
+        redefined with another expression.
+        '''
+        with self._lock:
+            schema = self._schemas.get(name)
+            if schema is None:
+                raise KeyError(name)
+            unknown = [c for c in expression.columns if c not in schema]
+            if unknown:
+                raise ExpressionError("unknown columns {}".format(", ".join(unknown)))
+            known = self._expressions.get(name, {})
+            if column in known and known[column].text != expression.text:
+                raise ExpressionError("{} is already defined as {}".format(column, known[column].text))
+            if column in schema and column not in known:
+                raise ExpressionError("{} is already a column of {}".format(column, name))
+            self._expressions.setdefault(name, {})[column] = expression
+            kind = "array" if any(schema[c].kind == "array" for c in expression.columns) else "scalar"
+            schema.columns[column] = ColumnInfo(column, kind, derived=True)
+            for entry in self._sources[name]:
+                if entry.chunk is not None:
+                    entry.chunk.add_expression(column, expression)
+
+    def expressions(self, name):
+        with self._lock:
+            return dict(self._expressions.get(name, {}))
+
+    def pin(self, name):
+        '''Chunks of pinned sources are never evicted'''
+        self._pinned.add(name)
+
+    def remove(self, name):
+        with self._lock:
+            for entry in self._sources.pop(name, []):
+                if entry.chunk is not None:
+                    self.nbytes -= entry.nbytes
+                if entry.path is not None:
+                    self.spilled_bytes -= entry.spilled_bytes
+                    os.remove(entry.path)
+            self._stats.pop(name, None)
+            self._schemas.pop(name, None)
+            self._expressions.pop(name, None)
+
+    def info(self):
+        with self._lock:
+            resident = sum(e.chunk is not None for entries in self._sources.values() for e in entries)
+            total = sum(len(entries) for entries in self._sources.values())
+            accesses = self.hits + self.misses
+            return {
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "sources": len(self._sources),
+                "resident_chunks": resident,
+                "evicted_chunks": total - resident,
+                "spilled_bytes": self.spilled_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/accesses if accesses else 1.,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._sources.clear()
+            self._stats.clear()
+            self._schemas.clear()
+            self._expressions.clear()
+            self.nbytes = 0
+            if self.spill_dir is not None:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _victim_source(self, exclude):
+        candidates = [n for n, entries in self._sources.items()
+                      if n not in self._pinned and any(e.chunk is not None and e is not exclude for e in entries)]
+        if not candidates:
+            return None
+        if self.policy == "lfu":
+            key = lambda n: (self._stats[n].hits, self._stats[n].last_access)
+        else:
+            key = lambda n: self._stats[n].last_access
+        return min(candidates, key=key)
+
+    def _evict(self, keep=None):
+        while self.nbytes > self.max_bytes:
+            name = self._victim_source(keep)
+            if name is None:
+                return
+            resident = [e for e in self._sources[name] if e.chunk is not None and e is not keep]
+            entry = min(resident, key=lambda e: e.last_access)
+            self._spill(name, entry)
+            entry.chunk = None
+            self.nbytes -= entry.nbytes
+            self.evictions += 1
+
+    def _spill(self, name, entry):
+        if self.spill_dir is None or entry.path is not None:
+            return
+        idx = self._sources[name].index(entry)
+        path = os.path.join(self.spill_dir, "{}_{}.npy".format(name, idx))
+        try:
+            np.save(path, entry.chunk.array)
+        except OSError as e:
+            print("failed to spill chunk {} of {}: {}".format(idx, name, e))
+            return
+        entry.path = path
+        entry.spilled_bytes = entry.chunk.array.nbytes
+        self.spilled_bytes += entry.spilled_bytes
+
+    def _reload(self, name, entry):
+        if entry.path is None:
+            raise ChunkEvicted("chunk of {} was evicted and spilling is disabled".format(name))
+        chunk = Chunk(np.load(entry.path, mmap_mode="r"))
+        for column, expression in self._expressions.get(name, {}).items():
+            chunk.add_expression(column, expression)
+        entry.nbytes = chunk.nbytes
+        return chunk
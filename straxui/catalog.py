@@ -0,0 +1,243 @@
+"""
+Index of the runs of a strax server for the run picker.
+The run table is fetched with a single scan_runs call (a DataFrame with one
+row per run like strax's Context.scan_runs, columns "name" and optionally
+"start", "source", "mode", "tags" and "<dataframe>_available") and kept as
+NumPy columns sorted by start time, newest first. A query over tens of
+thousands of runs is then a handful of vectorized comparisons. Terms are
+separated by spaces and all have to match, a leading - negates a term:
+
+    180423                 run names containing 180423
+    tag:sciencerun1 -tag:messy
+    source:kr83m mode:calibration
+    has:peaks              peaks is available for the run
+    after:2018-04-01 before:2018-05-01
+
+Refreshes only ask for runs started after the newest one known
+(scan_runs(after=...)) and put them in front of the index. Runs that were
+retagged or deleted are picked up by a full rescan every
+STRAXUI_CATALOG_FULL_REFRESH seconds.
+"""
+import os
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+import metrics
+
+prefixes = ("tag", "source", "mode", "has", "after", "before")
+
+
+class QueryError(ValueError):
+    pass
+
+
+class _Index:
+    """
+    Immutable columns of all runs, replaced as a whole on refresh.
+    """
+
+    def __init__(self, records):
+        names = sorted(records, key=lambda n: (records[n][0], n), reverse=True)
+        self.names = np.array(names, dtype=object)
+        self.start = np.array([records[n][0] for n in names], dtype=np.int64)
+        self.source = np.array([records[n][1].lower() for n in names], dtype=object)
+        self.mode = np.array([records[n][2].lower() for n in names], dtype=object)
+        tags = {}
+        available = {}
+        for i, n in enumerate(names):
+            for tag in records[n][3]:
+                tags.setdefault(tag.lower(), []).append(i)
+            for dfname in records[n][4]:
+                available.setdefault(dfname, []).append(i)
+        self.tags = {t: self._mask(rows) for t, rows in tags.items()}
+        self.available = {d: self._mask(rows) for d, rows in available.items()}
+        # all names in one string, a substring search is one scan in C instead of a loop over runs
+        self.text = "\n".join(n.lower() for n in names) + "\n"
+        self.line_starts = np.cumsum([0] + [len(n) + 1 for n in names[:-1]], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def extended(self, records):
+        '''
+        A new index with the runs of records, all newer than the runs of this one, in front.
+        '''
+        new = _Index(records)
+        index = _Index({})
+        for attr in ("names", "start", "source", "mode"):
+            setattr(index, attr, np.concatenate([getattr(new, attr), getattr(self, attr)]))
+        for attr in ("tags", "available"):
+            ours, theirs = getattr(self, attr), getattr(new, attr)
+            setattr(index, attr, {
+                key: np.concatenate([theirs.get(key, np.zeros(len(new), dtype=bool)),
+                                     ours.get(key, np.zeros(len(self), dtype=bool))])
+                for key in set(ours) | set(theirs)
+            })
+        index.text = new.text + self.text
+        index.line_starts = np.concatenate([new.line_starts, self.line_starts + len(new.text)]) if len(self) else new.line_starts
+        return index
+
+    def _mask(self, rows):
+        mask = np.zeros(len(self.names), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def name_mask(self, text):
+        mask = np.zeros(len(self.names), dtype=bool)
+        if "\n" in text:
+            return mask
+        positions = [m.start() for m in re.finditer(re.escape(text), self.text)]
+        if positions:
+            mask[np.searchsorted(self.line_starts, positions, side="right") - 1] = True
+        return mask
+
+    def term_mask(self, term):
+        prefix, sep, value = term.partition(":")
+        if not sep or prefix not in prefixes:
+            return self.name_mask(term)
+        if prefix == "tag":
+            return self.tags.get(value, np.zeros(len(self), dtype=bool))
+        if prefix == "has":
+            return self.available.get(value, np.zeros(len(self), dtype=bool))
+        if prefix in ("source", "mode"):
+            return getattr(self, prefix) == value
+        try:
+            when = pd.Timestamp(value).value
+        except ValueError:
+            raise QueryError("invalid date {}".format(value))
+        return self.start >= when if prefix == "after" else self.start < when
+
+    def query(self, text):
+        '''
+        Row numbers of the runs matching all terms of text, newest first.
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for term in text.split():
+            term = term.lower()
+            if term.startswith("-") and len(term) > 1:
+                mask &= ~self.term_mask(term[1:])
+            else:
+                mask &= self.term_mask(term)
+        return np.flatnonzero(mask)
+
+
+def _records(df):
+    '''
+    name -> (start [ns], source, mode, tags, available dataframes) for a run table.
+    '''
+    n = len(df)
+    names = df["name"].astype(str).tolist()
+    start = pd.to_datetime(df["start"]).values.astype("datetime64[ns]").astype(np.int64) if "start" in df else np.zeros(n, dtype=np.int64)
+    def strings(column):
+        if column not in df:
+            return [""]*n
+        return df[column].fillna("").astype(str).tolist()
+    source, mode = strings("source"), strings("mode")
+    tags = [tuple(t.strip() for t in value.split(",") if t.strip()) for value in strings("tags")]
+    available = [c for c in df.columns if isinstance(c, str) and c.endswith("_available")]
+    flags = {c[:-len("_available")]: df[c].fillna(False).astype(bool).values for c in available}
+    return {
+        names[i]: (int(start[i]), source[i], mode[i], tags[i], tuple(d for d, f in flags.items() if f[i]))
+        for i in range(n)
+    }
+
+
+class RunCatalog:
+    """
+    Runs of one strax server. refresh() blocks on the server and is meant
+    for an executor, queries only read the current index and never block.
+    """
+
+    def __init__(self, refresh_interval=300, full_refresh_interval=3600):
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.records = {}
+        self.updated = None
+        self.full_updated = None
+        self.error = None
+        self._index = _Index({})
+        self._refreshing = threading.Lock()
+
+    @classmethod
+    def from_environ(cls):
+        return cls(refresh_interval=float(os.environ.get("STRAXUI_CATALOG_REFRESH", 300)),
+                   full_refresh_interval=float(os.environ.get("STRAXUI_CATALOG_FULL_REFRESH", 3600)))
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def stale(self):
+        return self.updated is None or time.monotonic() - self.updated > self.refresh_interval
+
+    def refresh(self, ctx):
+        '''
+        Fetch the runs started after the newest known one and add them to the
+        index, or the whole run table when a full rescan is due. Returns the
+        number of added, changed or removed runs. A call made while another
+        refresh is running waits for it instead and returns 0.
+        '''
+        requested = time.monotonic()
+        with self._refreshing:
+            if self.updated is not None and self.updated >= requested:
+                # refreshed by a concurrent call while waiting
+                return 0
+            full = (self.full_updated is None or requested - self.full_updated > self.full_refresh_interval
+                    or not len(self._index) or not self._index.start[0])
+            try:
+                changes = self._full_refresh(ctx) if full else self._add_new_runs(ctx)
+            except Exception as e:
+                self.error = e
+                self.updated = time.monotonic()
+                print("failed to fetch the runs of {}: {}".format(getattr(ctx, "addr", ctx), e))
+                return 0
+            self.error = None
+            # only once the index is swapped, a session seeing a fresh catalog never sees an empty one
+            self.updated = time.monotonic()
+            if full:
+                self.full_updated = self.updated
+            return changes
+
+    def _scan_runs(self, ctx, **kwargs):
+        with metrics.timer("straxui_rpc_seconds", method="scan_runs"):
+            return _records(ctx.scan_runs(**kwargs))
+
+    def _full_refresh(self, ctx):
+        records = self._scan_runs(ctx)
+        changes = sum(1 for n, r in records.items() if self.records.get(n) != r)
+        changes += sum(1 for n in self.records if n not in records)
+        if changes:
+            # built aside and swapped in, queries running meanwhile use the old index
+            self._index = _Index(records)
+            self.records = records
+        return changes
+
+    def _add_new_runs(self, ctx):
+        try:
+            records = self._scan_runs(ctx, after=int(self._index.start[0]))
+        except TypeError:
+            # a server without incremental scans
+            self.full_updated = None
+            return self._full_refresh(ctx)
+        latest = self._index.start[0]
+        # runs registered late with an older start wait for the next full rescan, the index stays sorted
+        records = {n: r for n, r in records.items() if n not in self.records and r[0] > latest}
+        if records:
+            self._index = self._index.extended(records)
+            self.records = dict(self.records, **records)
+        return len(records)
+
+    def query(self, text="", offset=0, limit=50):
+        '''
+        Returns (total number of matching runs, names of runs offset to offset+limit).
+        Raises QueryError for invalid terms.
+        '''
+        index = self._index
+        with metrics.timer("straxui_catalog_query_seconds"):
+            rows = index.query(text)
+        return len(rows), index.names[rows[offset:offset+limit]].tolist()
+
+    def __contains__(self, name):
+        return name in self.records
@@ -0,0 +1,68 @@
+"""
+Mapping of column values onto the `catagories` of a plot template selector.
+Bins are computed once per (source, column) and applied with searchsorted,
+only small integer codes (colors) or numbers (sizes, alphas) are sent to
+the browser, colors are resolved there by a LinearColorMapper.
+"""
+import numpy as np
+from bokeh.models import LinearColorMapper
+from schema import max_distinct
+
+
+class CategoryMapping:
+    """
+    Quantile bins (or the distinct values, if there are few) of a column
+    mapped onto a list of categories. `info` is the schema.ColumnInfo of the
+    column over the whole source, its distinct values are used when known.
+    """
+
+    def __init__(self, values, cats, info=None):
+        self.cats = list(cats)
+        values = np.asarray(values)
+        if values.dtype.kind == "f":
+            values = values[np.isfinite(values)]
+        if info is not None and info.cardinality is not None:
+            # every value of the source, not just those of the sampled chunk
+            uniques = np.array(sorted(info.distinct))
+        elif info is not None and info.numeric and info.rows and len(self.cats) <= max_distinct:
+            # more distinct values than categories, no need to find them
+            uniques = None
+        else:
+            uniques = np.unique(values)
+        if uniques is None or len(uniques) > len(self.cats):
+            # equivalent to pd.qcut(values, len(cats), duplicates='drop')
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, len(self.cats)+1)))
+            self.bounds = edges[1:-1]
+            self.size = len(edges)-1
+        else:
+            self.bounds = None
+            self.uniques = uniques
+            self.size = len(uniques)
+        self.is_color = all(isinstance(c, str) for c in self.cats)
+        self.values = None if self.is_color else np.asarray(self.cats, dtype=np.float64)
+
+    def codes(self, values):
+        if self.bounds is not None:
+            # bins are closed on the right like pd.qcut
+            codes = np.searchsorted(self.bounds, values, side="left")
+        else:
+            codes = np.searchsorted(self.uniques, values)
+        return np.clip(codes, 0, max(self.size-1, 0)).astype(np.int16)
+
+    def column(self, values):
+        '''
+        Codes for color categories, the category values otherwise.
+        '''
+        codes = self.codes(values)
+        if self.is_color:
+            return codes
+        return self.values[codes]
+
+    def spec(self, name):
+        '''
+        Glyph kwarg value for the mapped column `name`.
+        '''
+        if not self.is_color:
+            return name
+        mapper = LinearColorMapper(palette=self.cats, low=-0.5, high=len(self.cats)-0.5)
+        return {"field": name, "transform": mapper}
@@ -0,0 +1,99 @@
+import numpy as np
+import derived
+from schema import SourceSchema
+import wire
+
+
+def source_data(columns, schema=None, mode=None, like=None):
+    '''
+    Convert a dict of numpy columns to ColumnDataSource data.
+    Scalar columns are sent as contiguous typed arrays so bokeh
+    can use its binary serialization, array columns as one view per row.
+    Columns are narrowed by wire.encode, see there for schema, mode and like.
+    '''
+    data = {n: col if col.ndim > 1 else np.ascontiguousarray(col) for n, col in columns.items()}
+    return wire.encode(data, "columns", schema, mode, like)
+
+
+class Chunk:
+    """
+    A single strax chunk kept as typed numpy columns.
+    Columns are views into the structured array returned by strax,
+    nothing is copied until the data is pushed to a ColumnDataSource.
+    Derived columns of array fields are listed but only computed
+    (and then kept) the first time they are requested.
+    """
+
+    def __init__(self, arr):
+        self.array = arr
+        self.fields = list(arr.dtype.names)
+        self.columns = {n: arr[n] for n in self.fields}
+        self.columns["_index"] = np.arange(len(arr))
+        self.derived = {}
+        for n in self.fields:
+            if self.columns[n].ndim > 1:
+                for r in derived.enabled_reductions():
+                    self.derived[derived.derived_name(r, n)] = (r, n)
+        self.expressions = {}
+        self._schema = None
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        yield from self.columns
+        for name in list(self.derived) + list(self.expressions):
+            if name not in self.columns:
+                yield name
+
+    def __contains__(self, name):
+        return name in self.columns or name in self.derived or name in self.expressions
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            if name in self.derived:
+                reduction, field = self.derived[name]
+                self.columns[name] = derived.compute(reduction, self.columns[field])
+            elif name in self.expressions:
+                self.columns[name] = self.expressions[name].evaluate(self)
+            else:
+                raise KeyError(name)
+        return self.columns[name]
+
+    def add_expression(self, name, expression):
+        '''
+        Add a column defined by an expressions.Expression, evaluated when first requested.
+        '''
+        self.expressions[name] = expression
+
+    def kind(self, name):
+        '''
+        Returns "array" or "scalar" for a column without computing it.
+        '''
+        if name in self.columns:
+            return "array" if self.columns[name].ndim > 1 else "scalar"
+        if name in self.expressions:
+            return self.expressions[name].kind(self)
+        reduction, _ = self.derived[name]
+        return "array" if reduction in derived.array_reductions else "scalar"
+
+    @property
+    def schema(self):
+        '''
+        Summary of the columns of this chunk, see schema.py.
+        '''
+        if self._schema is None:
+            self._schema = SourceSchema.from_chunk(self)
+        return self._schema
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes + sum(c.nbytes for c in self.columns.values() if c.flags.owndata)
+
+    def to_source_data(self, names=None):
+        '''
+        Returns a dict suitable for ColumnDataSource.data.
+        '''
+        if names is None:
+            names = list(self.columns)
+        return source_data({n: self[n] for n in names}, self.schema)
@@ -0,0 +1,299 @@
+"""
+Process wide data shared by all bokeh sessions.
+The server lifecycle creates a single DataLayer holding the strax clients,
+the chunk cache and the fetch pipeline. Loads of the same source are
+deduplicated, every session subscribes to the running load and reads the
+immutable chunks from the shared cache, keeping only UI state per session.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from straxrpc.client import StraxClient
+from cache import ChunkCache
+from chunks import Chunk
+from pipeline import FetchPipeline, LoadStats, select_arrays
+from metadata import MetadataService
+from diskcache import DiskCache, config_hash
+from fakeclient import FakeStraxClient
+from catalog import RunCatalog
+import metrics
+
+
+def source_name(dfname, run_id, fields=None, seconds_range=None, addr=None):
+    '''
+    Cache name of a source, partial loads get the fields and time window appended
+    and sources of other than the default strax server the server address.
+    '''
+    name = "{}_{}".format(dfname, run_id)
+    if seconds_range is not None:
+        start, stop = seconds_range
+        name += "_{}-{}s".format("" if start is None else "{:g}".format(start), "" if stop is None else "{:g}".format(stop))
+    if fields:
+        name += "[{}]".format(",".join(fields))
+    if addr is not None:
+        name += "@{}".format(addr)
+    return name
+
+
+def random_chunk():
+    arr = np.zeros(100, dtype=[("x", np.int64), ("y", np.float64), ("time", np.float64),
+        ("length", np.float64), ("xs", np.int64, (10,)), ("ys", np.float64, (10,))])
+    arr["x"] = np.arange(100)
+    arr["y"] = 90*np.random.rand(100)
+    arr["time"] = 10.*np.random.rand(100)
+    arr["length"] = 800.*np.random.rand(100)
+    arr["xs"] = np.arange(10)
+    arr["ys"] = 90*np.random.rand(100, 10)
+    return Chunk(arr)
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class Load:
+    """
+    A single fetch of a (run_id, dataframe) source.
+    Listeners are called from the loading thread and must not block,
+    typically they just schedule a callback on their session's document.
+    A running load is cancelled as soon as its last listener unsubscribes.
+    """
+
+    def __init__(self, name, run_id, dfname, fields=None, seconds_range=None):
+        self.name = name
+        self.run_id = run_id
+        self.dfname = dfname
+        self.fields = fields
+        self.seconds_range = seconds_range
+        self.stats = LoadStats()
+        self.received = 0
+        self.finished = False
+        self.error = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, owner, on_chunk, on_finished):
+        '''
+        Register on_chunk(idx) and on_finished(load) for owner (a session id).
+        Chunks that arrived before subscribing are replayed immediately.
+        '''
+        with self._lock:
+            for idx in range(self.received):
+                on_chunk(idx)
+            if self.finished:
+                on_finished(self)
+            else:
+                self._listeners[owner] = (on_chunk, on_finished)
+
+    def owners(self):
+        with self._lock:
+            return list(self._listeners)
+
+    def unsubscribe(self, owner):
+        with self._lock:
+            self._listeners.pop(owner, None)
+            if not self._listeners and not self.finished:
+                self.cancelled.set()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def chunk_stored(self, idx):
+        with self._lock:
+            self.received = idx+1
+            for on_chunk, _ in self._listeners.values():
+                on_chunk(idx)
+
+    def finish(self, error=None):
+        with self._lock:
+            self.error = error
+            self.finished = True
+            self.done.set()
+            self.stats.finish()
+            listeners, self._listeners = self._listeners, {}
+            for _, on_finished in listeners.values():
+                on_finished(self)
+
+
+class DataLayer:
+    """
+    Clients, cache and loads shared between all sessions of the server.
+    """
+
+    def __init__(self):
+        self.cache = ChunkCache.from_environ()
+        self.cache.pin("__random__")
+        self.cache.append("__random__", random_chunk())
+        self.pipeline = FetchPipeline.from_environ()
+        self.metadata = MetadataService.from_environ()
+        self.disk_cache = DiskCache.from_environ()
+        # a load holds its worker until the whole run is fetched
+        self.executor = ThreadPoolExecutor(max_workers=int(os.environ.get("STRAXUI_LOAD_WORKERS", 4)))
+        # short blocking work of the sessions (Page.submit): metadata RPCs, counts, starting aggregations
+        self.ui_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("STRAXUI_UI_WORKERS", 8)))
+        # per chunk work of whole run aggregations, separate so it never waits on loads or session work
+        self.aggregate_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("STRAXUI_AGGREGATE_WORKERS", 4)))
+        self.export_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("STRAXUI_EXPORT_WORKERS", 2)))
+        self.default_addr = os.environ.get("STRAXRPC_ADDR", "localhost:50051")
+        for pool_name, pool in (("load", self.executor), ("ui", self.ui_executor), ("aggregate", self.aggregate_executor),
+                                ("export", self.export_executor), ("fetch", self.pipeline.pool)):
+            metrics.gauge("straxui_executor_queue_depth", pool._work_queue.qsize, pool=pool_name)
+        metrics.gauge("straxui_cache_bytes", lambda: self.cache.nbytes)
+        metrics.gauge("straxui_cache_hit_rate", lambda: self.cache.info()["hit_rate"])
+        metrics.gauge("straxui_running_loads", lambda: sum(not l.finished for l in list(self._loads.values())))
+        self._clients = {}
+        self._catalogs = {}
+        self._loads = {}
+        self._lock = threading.Lock()
+
+    def client(self, addr=None):
+        addr = addr or self.default_addr
+        with self._lock:
+            if addr not in self._clients:
+                # STRAXRPC_ADDR=fake serves generated data, see fakeclient.py
+                fake = addr == "fake" or addr.startswith("fake:")
+                self._clients[addr] = FakeStraxClient.from_environ(addr) if fake else StraxClient(addr)
+            return self._clients[addr]
+
+    def source_name(self, addr, dfname, run_id, fields=None, seconds_range=None):
+        '''
+        Cache name of a source of the strax server at addr, the default server if None.
+        '''
+        # sessions may switch servers, the same run of two servers must not share cache entries
+        addr = None if addr in (None, self.default_addr) else addr
+        return source_name(dfname, run_id, fields, seconds_range, addr)
+
+    def catalog(self, ctx):
+        '''
+        The RunCatalog of ctx's server, empty until refreshed.
+        '''
+        with self._lock:
+            if ctx.addr not in self._catalogs:
+                self._catalogs[ctx.addr] = RunCatalog.from_environ()
+            return self._catalogs[ctx.addr]
+
+    def load(self, ctx, run_id, dfname, fields=None, seconds_range=None):
+        '''
+        Returns the Load for a source, starting it unless it
+        is already running or has completed successfully.
+        Only the given fields and the rows in seconds_range, (start, stop)
+        in seconds since the first row of the run, are loaded if given.
+        '''
+        # the order of the fields does not matter, the dtype's is kept
+        fields = tuple(sorted(fields)) if fields else None
+        if seconds_range == (None, None):
+            seconds_range = None
+        name = self.source_name(ctx.addr, dfname, run_id, fields, seconds_range)
+        with self._lock:
+            previous = load = self._loads.get(name)
+            if load is not None and load.error is None and not load.cancelled.is_set() and (name in self.cache or not load.finished):
+                return load
+            load = self._loads[name] = Load(name, run_id, dfname, fields, seconds_range)
+            if previous is None and name in self.cache:
+                # loaded by other means, e.g. the demo source
+                load.received = self.cache.count(name)
+                load.finish()
+                return load
+        self.executor.submit(self._run, ctx, load, previous)
+        return load
+
+    def _run(self, ctx, load, previous=None):
+        if previous is not None:
+            # a cancelled load of the same source may still be cleaning up
+            previous.done.wait()
+        key = self.disk_key(ctx, load)
+        writer = None
+        partial = bool(load.fields) or load.seconds_range is not None
+        if key is not None and key in self.disk_cache:
+            # stored column wise, only the files of the requested fields are read
+            arrays = self.disk_cache.arrays(key, load.fields and load.fields + ("time",))
+        else:
+            arrays = ctx.get_array_iter(load.run_id, load.dfname)
+            if key is not None and not partial:
+                writer = self.disk_cache.writer(key)
+        if partial:
+            # the strax server streams whole chunks, cut them down before they are prepared and cached
+            arrays = select_arrays(arrays, load.fields, load.seconds_range)
+        def deliver(idx, chunk, done):
+            self.cache.append(load.name, chunk)
+            done()
+            if writer is not None:
+                writer.add(chunk.array)
+            load.chunk_stored(idx)
+        try:
+            self.pipeline.run(arrays, deliver, stats=load.stats, cancel=load.cancelled)
+            if load.cancelled.is_set():
+                raise LoadCancelled("load of {} was cancelled".format(load.name))
+            if writer is not None:
+                writer.commit()
+        except Exception as e:
+            if not isinstance(e, LoadCancelled):
+                print("failed to load {}: {}".format(load.name, e))
+            if writer is not None:
+                writer.abort()
+            # a newer load of the same source waits for done before storing
+            # chunks, so everything cached under the name is from this load
+            self.cache.remove(load.name)
+            load.finish(error=e)
+        else:
+            load.finish()
+
+    def disk_key(self, ctx, load):
+        '''
+        Disk cache key of a load, None if the disk cache is off or the config is unknown.
+        '''
+        if self.disk_cache is None:
+            return None
+        try:
+            config = self.metadata.get(ctx, "show_config", load.dfname)
+        except Exception as e:
+            print("not using the disk cache for {}, failed to get its config: {}".format(load.name, e))
+            return None
+        return [ctx.addr, load.run_id, load.dfname, config_hash(config)]
+
+    def release_session(self, owner):
+        '''
+        Drop all subscriptions of a session, cancelling loads nobody follows anymore.
+        '''
+        self.metadata.unsubscribe(owner)
+        with self._lock:
+            loads = list(self._loads.values())
+        for load in loads:
+            for o in load.owners():
+                # pages may subscribe as "{session_id}:{page}"
+                if o == owner or o.startswith(owner + ":"):
+                    load.unsubscribe(o)
+
+    def get_load(self, name):
+        with self._lock:
+            return self._loads.get(name)
+
+    def shutdown(self):
+        self.metadata.stop()
+        self.executor.shutdown(wait=False)
+        self.ui_executor.shutdown(wait=False)
+        self.aggregate_executor.shutdown(wait=False)
+        self.export_executor.shutdown(wait=False)
+        self.pipeline.shutdown()
+        self.cache.close()
+
+
+_data_layer = None
+_data_layer_lock = threading.Lock()
+
+def get_data_layer():
+    global _data_layer
+    with _data_layer_lock:
+        if _data_layer is None:
+            _data_layer = DataLayer()
+        return _data_layer
+
+def shutdown_data_layer():
+    global _data_layer
+    with _data_layer_lock:
+        if _data_layer is not None:
+            _data_layer.shutdown()
+            _data_layer = None
@@ -0,0 +1,60 @@
+"""
+Derived columns computed from array valued strax fields.
+Every reduction works on the whole 2-D field of a chunk at once
+and is only evaluated when a column is actually requested.
+"""
+import os
+import re
+import numpy as np
+
+reductions = {}
+array_reductions = set()
+
+def register_reduction(name, func, array=False):
+    '''
+    Register a reduction `func(values) -> np.ndarray`, where values is
+    the 2-D field with one row per event. Array reductions return one row
+    per event instead of a scalar and are treated as array columns.
+    '''
+    reductions[name] = func
+    if array:
+        array_reductions.add(name)
+    else:
+        array_reductions.discard(name)
+
+def enabled_reductions():
+    names = os.environ.get("STRAXUI_REDUCTIONS", "")
+    if not names:
+        return list(reductions)
+    return [n.strip() for n in names.split(",") if n.strip() in reductions]
+
+def _area_fraction(values):
+    '''Fraction of the summed field contained in the largest sample'''
+    total = values.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total != 0, values.max(axis=1) / total, np.nan)
+
+register_reduction("mean", lambda values: values.mean(axis=1))
+register_reduction("std", lambda values: values.std(axis=1))
+register_reduction("max", lambda values: values.max(axis=1))
+register_reduction("argmax", lambda values: values.argmax(axis=1))
+register_reduction("area_fraction", _area_fraction)
+register_reduction("index", lambda values: np.broadcast_to(np.arange(values.shape[1]), values.shape), array=True)
+
+_name_re = re.compile(r"^(\w+)\((.+)\)$")
+
+def derived_name(reduction, field):
+    return "{}({})".format(reduction, field)
+
+def parse_derived_name(name):
+    '''
+    Returns (reduction, field) for a derived column name or None.
+    '''
+    match = _name_re.match(name)
+    if match is None or match.group(1) not in reductions:
+        return None
+    return match.group(1), match.group(2)
+
+def compute(reduction, values):
+    values = values.reshape(len(values), -1)
+    return reductions[reduction](values)
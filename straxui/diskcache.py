@@ -0,0 +1,170 @@
+"""
+Optional on-disk store of fetched runs that survives server restarts.
+Runs are keyed by (server address, run_id, dataframe, strax config hash)
+and kept column wise, one .npy file per field and chunk, which are memory
+mapped when the run is loaded again. A load of a few fields only reads
+the files of those fields. Only completely fetched runs are used, the least recently
+used runs are deleted once the size limit is exceeded. Enable with
+
+    STRAXUI_DISK_CACHE=/path/to/dir STRAXUI_DISK_CACHE_MB=20000
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+
+# runs stored in an older layout are ignored and eventually evicted
+layout = "columns"
+
+
+def config_hash(config):
+    '''
+    Stable hash of the result of show_config (a DataFrame) or any json-able value.
+    '''
+    if hasattr(config, "to_json"):
+        text = config.to_json(orient="records")
+    else:
+        text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class RunWriter:
+    """
+    Writes the chunks of one run while it is fetched,
+    the run only becomes visible once commit() is called.
+    """
+
+    def __init__(self, cache, key, path):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.chunks = 0
+        self.nbytes = 0
+        self.fields = None
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+    def add(self, arr):
+        path = os.path.join(self.path, str(self.chunks))
+        os.makedirs(path)
+        for name in arr.dtype.names:
+            np.save(os.path.join(path, "{}.npy".format(name)), arr[name])
+        if self.fields is None:
+            self.fields = list(arr.dtype.names)
+        self.chunks += 1
+        self.nbytes += arr.nbytes
+
+    def commit(self):
+        self.cache._commit(self)
+
+    def abort(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class DiskCache:
+    """
+    Size limited directory of fetched runs.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._info = None
+        os.makedirs(root, exist_ok=True)
+        # left over from loads interrupted by a restart
+        for name in os.listdir(root):
+            if name.endswith(".partial"):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    @classmethod
+    def from_environ(cls):
+        '''
+        Returns None unless STRAXUI_DISK_CACHE is set.
+        '''
+        root = os.environ.get("STRAXUI_DISK_CACHE")
+        if not root:
+            return None
+        return cls(root, int(float(os.environ.get("STRAXUI_DISK_CACHE_MB", 20000))*1e6))
+
+    def _dir(self, key):
+        return os.path.join(self.root, hashlib.sha1(json.dumps(key).encode()).hexdigest())
+
+    def _meta(self, path):
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, key):
+        meta = self._meta(self._dir(key))
+        return meta is not None and meta.get("layout") == layout
+
+    def arrays(self, key, fields=None):
+        '''
+        Iterate over the chunks of a stored run, as structured arrays of the
+        given fields (all by default) read from their memory mapped files.
+        '''
+        path = self._dir(key)
+        meta = self._meta(path)
+        if meta is None or meta.get("layout") != layout:
+            raise KeyError(key)
+        names = [f for f in meta["fields"] if fields is None or f in fields]
+        # the modification time of the directory is used for LRU eviction
+        os.utime(path)
+        for idx in range(meta["chunks"]):
+            columns = [np.load(os.path.join(path, str(idx), "{}.npy".format(n)), mmap_mode="r") for n in names]
+            arr = np.empty(len(columns[0]) if columns else 0, dtype=[(n, c.dtype, c.shape[1:]) for n, c in zip(names, columns)])
+            for n, c in zip(names, columns):
+                arr[n] = c
+            yield arr
+
+    def writer(self, key):
+        return RunWriter(self, key, self._dir(key) + ".partial")
+
+    def _commit(self, writer):
+        path = self._dir(writer.key)
+        meta = {"key": writer.key, "layout": layout, "fields": writer.fields or [], "chunks": writer.chunks,
+                "nbytes": writer.nbytes, "created": time.time()}
+        with open(os.path.join(writer.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        with self._lock:
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(writer.path, path)
+            self._evict(keep=path)
+            self._info = None
+
+    def runs(self):
+        '''
+        (path, meta, last access) of all complete runs.
+        '''
+        runs = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta = self._meta(path) if not name.endswith(".partial") else None
+            if meta is not None:
+                runs.append((path, meta, os.path.getmtime(path)))
+        return runs
+
+    def info(self):
+        with self._lock:
+            # only changes on commit, avoid listing the directory on every call
+            if self._info is None:
+                runs = self.runs()
+                self._info = {"runs": len(runs), "nbytes": sum(m["nbytes"] for _, m, _ in runs), "max_bytes": self.max_bytes}
+            return dict(self._info)
+
+    def _evict(self, keep=None):
+        runs = sorted(self.runs(), key=lambda r: r[2])
+        nbytes = sum(m["nbytes"] for _, m, _ in runs)
+        for path, meta, _ in runs:
+            if nbytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            nbytes -= meta["nbytes"]
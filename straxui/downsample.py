@@ -0,0 +1,208 @@
+"""
+Server side downsampling of scatter glyphs.
+Depending on the visible x/y range and the plot size, either all points in
+view, a decimated subset (largest triangle three buckets) or a 2-D histogram
+image is sent to the browser. Glyphs opt in from the plot template with e.g.
+
+    "downsample": {"method": "lttb", "max_points": 20000, "pixels_per_bin": 4}
+
+With an executor the downsampling runs there and only the result is
+assigned on the document thread, so panning never blocks the session.
+"""
+from functools import partial
+import numpy as np
+from bokeh.models import ColumnDataSource, LinearColorMapper
+from bokeh.palettes import Plasma256
+from bokeh.core.property.validation import validate
+import wire
+
+methods = ("lttb", "bin")
+
+def lttb(x, y, n_out):
+    '''
+    Indices of n_out points selected from a series sorted by x,
+    using the largest triangle three buckets algorithm.
+    '''
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n-1, n_out-1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n-1
+    a = 0
+    for i in range(n_out-2):
+        lo, hi = edges[i], edges[i+1]
+        nlo, nhi = (edges[i+1], edges[i+2]) if i+2 < len(edges) else (n-1, n)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a]-avg_x)*(y[lo:hi]-y[a]) - (x[a]-x[lo:hi])*(avg_y-y[a]))
+        a = lo + np.argmax(area)
+        out[i+1] = a
+    return out
+
+def in_range(x, y, x_range, y_range):
+    '''
+    Boolean mask of finite points inside the given (start, end) ranges.
+    '''
+    mask = np.isfinite(x) & np.isfinite(y)
+    for values, (start, end) in ((x, x_range), (y, y_range)):
+        if start is not None:
+            mask &= values >= min(start, end)
+            mask &= values <= max(start, end)
+    return mask
+
+def bin2d(x, y, x_range, y_range, shape):
+    '''
+    Counts of points on a (ny, nx) grid spanning the given ranges.
+    '''
+    nx, ny = shape
+    counts, xedges, yedges = np.histogram2d(x, y, bins=(nx, ny), range=(sorted(x_range), sorted(y_range)))
+    return counts.T
+
+def data_range(values, pad=0.05):
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return 0., 1.
+    return pad_range(float(values.min()), float(values.max()), pad)
+
+def pad_range(lo, hi, pad=0.05):
+    if hi == lo:
+        return lo-0.5, hi+0.5
+    return lo-pad*(hi-lo), hi+pad*(hi-lo)
+
+
+def downsample(columns, x, y, x_range, y_range, method, max_points, shape):
+    '''
+    Encoded (data, image) source data of the points of columns in view,
+    ranges that are None span the data.
+    '''
+    if x_range is None:
+        x_range = data_range(columns[x], pad=0)
+    if y_range is None:
+        y_range = data_range(columns[y], pad=0)
+    xs, ys = columns[x], columns[y]
+    rows = np.flatnonzero(in_range(xs, ys, x_range, y_range))
+    image = {"image": [], "x": [], "y": [], "dw": [], "dh": []}
+    if len(rows) > max_points:
+        if method == "lttb":
+            rows = rows[np.argsort(xs[rows], kind="mergesort")]
+            rows = rows[lttb(xs[rows], ys[rows], max_points)]
+        else:
+            counts = bin2d(xs[rows], ys[rows], x_range, y_range, shape)
+            # log scale so sparse regions stay visible next to dense cores
+            counts = np.where(counts > 0, np.log1p(counts), np.nan)
+            image = {"image": [counts], "x": [min(x_range)], "y": [min(y_range)],
+                     "dw": [abs(x_range[1]-x_range[0])], "dh": [abs(y_range[1]-y_range[0])]}
+            rows = rows[:0]
+    data = {}
+    for n, col in columns.items():
+        col = col[rows]
+        data[n] = list(col) if col.ndim > 1 else col
+    return wire.encode(data, "downsampled"), wire.encode(image, "image")
+
+
+class DownsampledGlyph:
+    """
+    Keeps the full columns of a glyph on the server and pushes
+    a downsampled version to `source` whenever the view changes.
+    """
+
+    def __init__(self, doc, fig, source, columns, x, y, options, executor=None):
+        self.doc = doc
+        self.executor = executor
+        self.fig = fig
+        self.source = source
+        self._parts = [columns]
+        self._columns = columns
+        self.x = x
+        self.y = y
+        self.method = options.get("method", "lttb")
+        if self.method not in methods:
+            raise ValueError("Unknown downsampling method {}".format(self.method))
+        self.max_points = options.get("max_points", 20000)
+        self.pixels_per_bin = options.get("pixels_per_bin", 4)
+        self.selection = None
+        self.image_source = ColumnDataSource({"image": [], "x": [], "y": [], "dw": [], "dh": []})
+        self._pending = None
+        # results of superseded updates are dropped
+        self._generation = 0
+        self.future = None
+        if self.method == "bin":
+            mapper = LinearColorMapper(palette=Plasma256, nan_color=(0, 0, 0, 0))
+            fig.image(image="image", x="x", y="y", dw="dw", dh="dh", color_mapper=mapper, source=self.image_source)
+        for r in (fig.x_range, fig.y_range):
+            r.on_change("start", self.range_changed)
+            r.on_change("end", self.range_changed)
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {n: np.concatenate([p[n] for p in self._parts]) for n in self._parts[0]}
+            self._parts = [self._columns]
+        return self._columns
+
+    def extend(self, columns):
+        '''
+        Add rows (e.g. a newly loaded chunk) and schedule an update of the view.
+        '''
+        self._parts.append(columns)
+        self._columns = None
+        self.range_changed(None, None, None)
+
+    def view(self):
+        '''
+        The visible (x_range, y_range), None where the figure has no range yet.
+        '''
+        x_range = (self.fig.x_range.start, self.fig.x_range.end)
+        y_range = (self.fig.y_range.start, self.fig.y_range.end)
+        return None if None in x_range else x_range, None if None in y_range else y_range
+
+    def range_changed(self, attr, old, new):
+        # ranges change continuously while panning, only recompute once they settle
+        if self._pending is not None:
+            try:
+                self.doc.remove_timeout_callback(self._pending)
+            except ValueError:
+                pass
+        self._pending = self.doc.add_timeout_callback(self.update, 200)
+
+    def update(self):
+        '''
+        Downsample for the current view, on the executor if there is one.
+        '''
+        self._pending = None
+        self._generation += 1
+        shape = (max(1, self.fig.plot_width//self.pixels_per_bin), max(1, self.fig.plot_height//self.pixels_per_bin))
+        args = (self.columns, self.x, self.y) + self.view() + (self.method, self.max_points, shape)
+        if self.executor is None:
+            self.show(self._generation, downsample(*args))
+            return
+        generation = self._generation
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print("failed to downsample {}, {}: {}".format(self.x, self.y, e))
+                return
+            self.doc.add_next_tick_callback(partial(self.show, generation, result))
+        self.future = self.executor.submit(downsample, *args)
+        self.future.add_done_callback(done)
+
+    def show(self, generation, result):
+        if generation != self._generation:
+            return
+        data, image = result
+        self.source.data = data
+        # skip bokeh's per pixel validation of the image list
+        with validate(False):
+            self.image_source.data = image
+        self.select()
+
+    def select(self):
+        '''
+        Mark the shown points inside the selection, which is a cut on the columns.
+        '''
+        data, selection = self.source.data, self.selection
+        if selection is not None and selection.x in data and selection.y in data:
+            self.source.selected.indices = np.flatnonzero(selection.mask(data)).tolist()
+        else:
+            self.source.selected.indices = []
@@ -0,0 +1,193 @@
+"""
+Streaming export of a whole source as CSV or Parquet.
+ExportHandler is a tornado handler registered next to the bokeh app by
+serve.py. Chunks are read one at a time from the cache (or straight from
+the strax server if the source is not loaded), converted on an executor and
+flushed to the response, so neither the run nor the file is ever held in
+memory and other sessions keep running while the export is in progress.
+
+    /export?source=event_basics_170621_0617&format=csv&columns=cs1,cs2
+    /export?run_id=170621_0617&dfname=event_basics&format=parquet
+"""
+import io
+import numpy as np
+import pandas as pd
+from tornado import gen, web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from chunks import Chunk
+from datalayer import get_data_layer, source_name
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+formats = ("csv", "parquet")
+content_types = {"csv": "text/csv", "parquet": "application/octet-stream"}
+
+
+def export_columns(chunk, columns=None, fmt="csv"):
+    '''
+    Columns to export, array columns are only supported by parquet.
+    '''
+    if not columns:
+        columns = chunk.fields
+    return [c for c in columns if c in chunk and (fmt == "parquet" or chunk.kind(c) == "scalar")]
+
+
+def csv_bytes(chunk, columns, header):
+    df = pd.DataFrame({c: chunk[c] for c in columns}, columns=columns)
+    return df.to_csv(index=False, header=header).encode()
+
+
+def arrow_table(chunk, columns):
+    arrays = []
+    for c in columns:
+        values = chunk[c]
+        if values.ndim > 1:
+            flat = pa.array(np.ascontiguousarray(values).reshape(-1))
+            arrays.append(pa.FixedSizeListArray.from_arrays(flat, int(np.prod(values.shape[1:]))))
+        else:
+            arrays.append(pa.array(np.ascontiguousarray(values)))
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+class _Sink(io.RawIOBase):
+    """
+    Write only file collecting what parquet writes until it is drained.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+class ParquetStream:
+    """
+    One row group per chunk, each returned as soon as it is written.
+    """
+
+    def __init__(self):
+        self.sink = _Sink()
+        self.writer = None
+
+    def chunk_bytes(self, chunk, columns):
+        table = arrow_table(chunk, columns)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.sink, table.schema)
+        self.writer.write_table(table)
+        return self.sink.drain()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        return self.sink.drain()
+
+
+class SourceIncomplete(Exception):
+    pass
+
+
+def source_chunks(data_layer, name=None, run_id=None, dfname=None, addr=None):
+    '''
+    Chunks of a loaded source, or streamed from the strax server without caching.
+    Raises KeyError for unknown sources and SourceIncomplete for sources still
+    loading right away. Blocking, call it and iterate the result from an executor.
+    '''
+    if name is None:
+        name = data_layer.source_name(addr, dfname, run_id)
+    load = data_layer.get_load(name)
+    if load is not None and not load.finished:
+        # only the chunks cached so far would be written, in a file that looks complete
+        raise SourceIncomplete("{} is still loading, {} chunks so far".format(name, load.received))
+    if name in data_layer.cache:
+        srcs = data_layer.cache[name]
+        return (srcs[idx] for idx in range(len(srcs)))
+    if run_id is None or dfname is None:
+        raise KeyError(name)
+    return (Chunk(arr) for arr in data_layer.client(addr).get_array_iter(run_id, dfname))
+
+
+class ExportHandler(web.RequestHandler):
+
+    @gen.coroutine
+    def get(self):
+        fmt = self.get_argument("format", "csv")
+        if fmt not in formats:
+            raise web.HTTPError(400, "unknown format {}".format(fmt))
+        if fmt == "parquet" and pa is None:
+            raise web.HTTPError(400, "parquet export needs pyarrow")
+        name = self.get_argument("source", None)
+        run_id = self.get_argument("run_id", None)
+        dfname = self.get_argument("dfname", None)
+        if name is None and (run_id is None or dfname is None):
+            raise web.HTTPError(400, "either source or run_id and dfname are required")
+        columns = [c for c in self.get_argument("columns", "").split(",") if c]
+        data_layer = get_data_layer()
+        executor = data_layer.export_executor
+        filename = name or source_name(dfname, run_id)
+        try:
+            # resolved before anything is sent, an error can still be answered with a status
+            chunks = yield IOLoop.current().run_in_executor(executor, source_chunks, data_layer, name, run_id,
+                                                            dfname, self.get_argument("addr", None))
+        except KeyError:
+            raise web.HTTPError(404, "unknown source {}".format(filename))
+        except SourceIncomplete as e:
+            raise web.HTTPError(409, str(e))
+
+        def next_bytes(stream, first):
+            # read and convert one chunk, None once the source is exhausted
+            chunk = next(chunks, None)
+            if chunk is None:
+                return None
+            names = export_columns(chunk, columns, fmt)
+            if stream is None:
+                return csv_bytes(chunk, names, header=first)
+            return stream.chunk_bytes(chunk, names)
+
+        stream = ParquetStream() if fmt == "parquet" else None
+        self.set_header("Content-Type", content_types[fmt])
+        self.set_header("Content-Disposition", 'attachment; filename="{}.{}"'.format(filename, fmt))
+        first = True
+        try:
+            while True:
+                data = yield IOLoop.current().run_in_executor(executor, next_bytes, stream, first)
+                if data is None:
+                    break
+                first = False
+                self.write(data)
+                # waits for the client, so a slow download never buffers the run
+                yield self.flush()
+            if stream is not None:
+                self.write(stream.close())
+        except StreamClosedError:
+            chunks.close()
+            return
+        except Exception as e:
+            chunks.close()
+            if first:
+                raise web.HTTPError(500, "export of {} failed: {}".format(filename, e))
+            # e.g. a chunk evicted meanwhile, the response is under way and can only
+            # be cut off, without the final chunk the client sees a failed download
+            print("export of {} failed: {}".format(filename, e))
+            self.request.connection.close()
+            return
+        self.finish()
@@ -0,0 +1,242 @@
+"""
+Cuts and new columns defined by expressions on the columns of a source, e.g.
+
+    cs1 > 100 & cs2/cs1 < 50
+    log10(cs2) - mean(data)
+
+An expression is parsed and checked once, then evaluated on whole chunk
+columns with numexpr (if installed) or NumPy. Like in pandas.eval, `&`, `|`
+and `~` bind weaker than comparisons. Calls of a reduction on an array field
+refer to the derived column, e.g. mean(data) is the column "mean(data)".
+Results are stored in the chunk like any other column.
+"""
+import ast
+import io
+import tokenize
+import numpy as np
+import derived
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+functions = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log, "log10": np.log10,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "arctan2": np.arctan2, "where": np.where,
+    "isnan": np.isnan, "isfinite": np.isfinite,
+}
+numexpr_functions = {"abs", "sqrt", "exp", "log", "log10", "sin", "cos", "tan", "arctan2", "where"}
+
+_operators = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+              ast.BitAnd, ast.BitOr, ast.BitXor, ast.Invert, ast.USub, ast.UAdd,
+              ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def _logical_tokens(text):
+    '''
+    Replace &, | and ~ by and, or and not so they get the precedence of boolean operators.
+    '''
+    replace = {"&": "and", "|": "or", "~": "not"}
+    tokens = []
+    for tok in tokenize.generate_tokens(io.StringIO(text).readline):
+        if tok.type == tokenize.OP and tok.string in replace:
+            tok = (tokenize.NAME, replace[tok.string])
+        else:
+            tok = (tok.type, tok.string)
+        tokens.append(tok)
+    return tokenize.untokenize(tokens)
+
+
+class _Compiler(ast.NodeTransformer):
+    """
+    Checks the syntax tree, turns boolean operators into bitwise ones
+    and replaces column references by placeholder names.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.numexpr = True
+
+    def column(self, name):
+        for placeholder, column in self.columns.items():
+            if column == name:
+                return ast.Name(id=placeholder, ctx=ast.Load())
+        placeholder = "_c{}".format(len(self.columns))
+        self.columns[placeholder] = name
+        return ast.Name(id=placeholder, ctx=ast.Load())
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Name(self, node):
+        if node.id in functions:
+            raise ExpressionError("{} is a function".format(node.id))
+        return self.column(node.id)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, bool)):
+            raise ExpressionError("unsupported constant {!r}".format(node.value))
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise ExpressionError("unsupported call")
+        name = node.func.id
+        if name in derived.reductions and len(node.args) == 1 and isinstance(node.args[0], ast.Name):
+            return self.column(derived.derived_name(name, node.args[0].id))
+        if name not in functions:
+            raise ExpressionError("unknown function {}".format(name))
+        if name not in numexpr_functions:
+            self.numexpr = False
+        node.args = [self.visit(a) for a in node.args]
+        return node
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(v) for v in node.values]
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = values[0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=operand)
+        self.check_op(node.op)
+        return ast.UnaryOp(op=node.op, operand=operand)
+
+    def visit_BinOp(self, node):
+        self.check_op(node.op)
+        if isinstance(node.op, ast.FloorDiv):
+            self.numexpr = False
+        return ast.BinOp(left=self.visit(node.left), op=node.op, right=self.visit(node.right))
+
+    def visit_Compare(self, node):
+        # a < b < c becomes (a < b) & (b < c), which also works on arrays
+        operands = [self.visit(node.left)] + [self.visit(c) for c in node.comparators]
+        result = None
+        for i, op in enumerate(node.ops):
+            self.check_op(op)
+            compare = ast.Compare(left=operands[i], ops=[op], comparators=[operands[i+1]])
+            result = compare if result is None else ast.BinOp(left=result, op=ast.BitAnd(), right=compare)
+        return result
+
+    def check_op(self, op):
+        if not isinstance(op, _operators):
+            raise ExpressionError("unsupported operator {}".format(type(op).__name__))
+
+    def generic_visit(self, node):
+        raise ExpressionError("unsupported syntax {}".format(type(node).__name__))
+
+
+class Expression:
+    """
+    A compiled expression, evaluated on chunks with evaluate(chunk).
+    """
+
+    def __init__(self, text):
+        self.text = text.strip()
+        try:
+            tree = ast.parse(_logical_tokens(self.text), mode="eval")
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise ExpressionError("invalid expression {!r}: {}".format(self.text, e))
+        compiler = _Compiler()
+        tree = ast.fix_missing_locations(compiler.visit(tree))
+        self.placeholders = compiler.columns
+        self.code = compile(tree, "<expression>", "eval")
+        self.numexpr_text = ast.unparse(tree) if numexpr is not None and compiler.numexpr else None
+
+    @property
+    def columns(self):
+        return list(self.placeholders.values())
+
+    def kind(self, chunk):
+        '''
+        "array" if any referenced column is an array column, without evaluating.
+        '''
+        return "array" if any(chunk.kind(c) == "array" for c in self.columns) else "scalar"
+
+    def evaluate(self, chunk):
+        values = {}
+        for placeholder, column in self.placeholders.items():
+            if column not in chunk:
+                raise ExpressionError("unknown column {}".format(column))
+            values[placeholder] = chunk[column]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = None
+            if self.numexpr_text is not None:
+                try:
+                    result = numexpr.evaluate(self.numexpr_text, local_dict=values)
+                except Exception:
+                    # e.g. dtypes numexpr does not support, numpy handles them
+                    result = None
+            if result is None:
+                result = eval(self.code, {"__builtins__": {}}, dict(functions, **values))
+        result = np.asarray(result)
+        if result.dtype.kind not in "biuf":
+            raise ExpressionError("{} is not numeric".format(self.text))
+        if result.ndim == 0:
+            result = np.full(len(chunk), result)
+        return result
+
+
+def parse_definition(text):
+    '''
+    Split "name = expression" into (name, Expression), the name defaults to the expression.
+    '''
+    name, sep, expression = text.partition("=")
+    if sep and expression[:1] != "=" and name.strip().isidentifier():
+        return name.strip(), Expression(expression)
+    return text.strip(), Expression(text)
+
+
+class Cut:
+    """
+    Rows for which a column (typically a boolean expression) is true,
+    usable as TableView mask.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def applies_to(self, chunk):
+        return self.name in chunk and chunk.kind(self.name) == "scalar"
+
+    def mask(self, chunk):
+        return np.asarray(chunk[self.name], dtype=bool)
+
+    def __str__(self):
+        return self.name
+
+
+class CutCount:
+    """
+    Number of rows passing a cut, an accumulator for aggregate.aggregate_chunks
+    so the cut is evaluated over all chunks on the worker pool.
+    """
+
+    def __init__(self, cut):
+        self.cut = cut
+        self.passed = 0
+        self.rows = 0
+        self.chunks = 0
+
+    def empty(self):
+        return CutCount(self.cut)
+
+    def add(self, chunk):
+        self.passed += int(self.cut.mask(chunk).sum())
+        self.rows += len(chunk)
+        self.chunks += 1
+
+    def merge(self, other):
+        self.passed += other.passed
+        self.rows += other.rows
+        self.chunks += other.chunks
@@ -0,0 +1,193 @@
+"""
+In-process stand-in for straxrpc's StraxClient, used by benchmark.py and
+to run the app without a strax server (STRAXRPC_ADDR=fake). Arrays are
+generated deterministically from (run_id, dataframe), so every run of a
+benchmark sees the same data. Sizes can be set with
+
+    STRAXUI_FAKE_ROWS=100000 STRAXUI_FAKE_CHUNKS=10 STRAXUI_FAKE_SAMPLES=200 STRAXUI_FAKE_RUNS=10000
+"""
+import fnmatch
+import os
+import time
+import zlib
+import numpy as np
+import pandas as pd
+
+
+def event_fields(samples):
+    return [
+        ("time", np.int64, "Start time since unix epoch [ns]"),
+        ("endtime", np.int64, "End time since unix epoch [ns]"),
+        ("s1_area", np.float32, "Main S1 area [PE]"),
+        ("s2_area", np.float32, "Main S2 area [PE]"),
+        ("cs1", np.float32, "Corrected S1 area [PE]"),
+        ("cs2", np.float32, "Corrected S2 area [PE]"),
+        ("drift_time", np.int32, "Drift time between main S1 and S2 [ns]"),
+        ("x", np.float32, "Reconstructed x position [cm]"),
+        ("y", np.float32, "Reconstructed y position [cm]"),
+        ("z", np.float32, "Interaction depth [cm]"),
+        ("n_peaks", np.int32, "Number of peaks in the event"),
+    ]
+
+
+def peak_fields(samples):
+    return [
+        ("time", np.int64, "Start time since unix epoch [ns]"),
+        ("endtime", np.int64, "End time since unix epoch [ns]"),
+        ("area", np.float32, "Peak area [PE]"),
+        ("type", np.int8, "Classification of the peak (0: unknown, 1: S1, 2: S2)"),
+        ("n_hits", np.int32, "Number of hits in the peak"),
+        ("length", np.int32, "Number of valid samples in data"),
+        ("dt", np.int16, "Width of a sample [ns]"),
+        ("data", (np.float32, (samples,)), "Waveform [PE/sample]"),
+        ("area_decile", (np.float32, (11,)), "Width to reach each area decile [ns]"),
+    ]
+
+
+dataframes = {
+    "event_basics": event_fields,
+    "event_info": event_fields,
+    "peaks": peak_fields,
+    "peak_basics": peak_fields,
+}
+
+
+sources = ["none", "Kr83m", "Rn220", "AmBe", "neutron_generator"]
+modes = ["background_stable", "calibration", "tpc_commissioning"]
+tags = ["sciencerun0", "sciencerun1", "messy", "bad", "blinded"]
+
+
+def generate_runs(n, seed=0):
+    '''
+    A run table like strax's Context.scan_runs, one run per hour.
+    '''
+    rng = np.random.RandomState(seed)
+    start = pd.Timestamp("2017-06-21") + pd.to_timedelta(np.arange(n), unit="h")
+    run_tags = [",".join(t for t in tags if rng.rand() < 0.15) for _ in range(n)]
+    runs = pd.DataFrame({
+        "name": start.strftime("%y%m%d_%H%M"),
+        "start": start,
+        "end": start + pd.Timedelta(minutes=55),
+        "source": np.array(sources)[rng.randint(len(sources), size=n)],
+        "mode": np.array(modes)[rng.randint(len(modes), size=n)],
+        "tags": run_tags,
+    })
+    for dfname in dataframes:
+        runs[dfname + "_available"] = rng.rand(n) < 0.8
+    return runs
+
+
+def _seed(*parts):
+    return zlib.crc32("/".join(parts).encode())
+
+
+def generate_chunk(fields, rows, rng, t0=0):
+    dtype = [(n, t) if not isinstance(t, tuple) else (n, t[0], t[1]) for n, t, _ in fields]
+    arr = np.zeros(rows, dtype=dtype)
+    spacing = rng.exponential(1e5, rows).astype(np.int64) + 1
+    arr["time"] = t0 + np.cumsum(spacing)
+    arr["endtime"] = arr["time"] + rng.randint(100, 10000, rows)
+    for name, kind, _ in fields:
+        if name in ("time", "endtime"):
+            continue
+        column = arr[name]
+        if column.ndim > 1:
+            # decaying pulses with noise, roughly like a peak waveform
+            samples = column.shape[1]
+            shape = np.exp(-np.arange(samples)/(0.1*samples+1))
+            column[:] = rng.exponential(10, (rows, 1))*shape + rng.normal(0, 0.1, (rows, samples))
+        elif column.dtype.kind == "f":
+            column[:] = rng.lognormal(3, 1.5, rows)
+        else:
+            column[:] = rng.poisson(3, rows)
+    if "length" in arr.dtype.names:
+        # like strax peaks, samples after the length of a waveform are zero
+        samples = arr["data"].shape[1]
+        arr["length"] = rng.randint(max(1, samples//4), samples+1, rows)
+        arr["data"][np.arange(samples)[None, :] >= arr["length"][:, None]] = 0
+        arr["dt"] = 10
+    return arr
+
+
+class FakeStraxClient:
+    """
+    Implements the StraxClient calls used by straxui.
+    latency is added to every call, bandwidth (bytes/s) limits get_array_iter.
+    """
+
+    def __init__(self, addr="fake", rows=10000, chunks=10, samples=200, runs=1000, latency=0., bandwidth=None):
+        self.addr = addr
+        self.runs = runs
+        self.rows = rows
+        self.chunks = chunks
+        self.samples = samples
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._run_table = None
+
+    @classmethod
+    def from_environ(cls, addr="fake"):
+        bandwidth = os.environ.get("STRAXUI_FAKE_BANDWIDTH_MB")
+        return cls(addr, rows=int(os.environ.get("STRAXUI_FAKE_ROWS", 10000)),
+                   chunks=int(os.environ.get("STRAXUI_FAKE_CHUNKS", 10)),
+                   samples=int(os.environ.get("STRAXUI_FAKE_SAMPLES", 200)),
+                   runs=int(os.environ.get("STRAXUI_FAKE_RUNS", 1000)),
+                   latency=float(os.environ.get("STRAXUI_FAKE_LATENCY", 0)),
+                   bandwidth=float(bandwidth)*1e6 if bandwidth else None)
+
+    def _wait(self, nbytes=0):
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes/self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def fields(self, dfname):
+        if dfname not in dataframes:
+            raise KeyError("unknown dataframe {}".format(dfname))
+        return dataframes[dfname](self.samples)
+
+    def search_dataframe_names(self, pattern):
+        self._wait()
+        return [n for n in dataframes if fnmatch.fnmatch(n, pattern)]
+
+    def search_field(self, pattern):
+        self._wait()
+        names = set()
+        for dfname in dataframes:
+            names.update(n for n, _, _ in self.fields(dfname) if fnmatch.fnmatch(n, pattern))
+        return sorted(names)
+
+    def data_info(self, dfname):
+        self._wait()
+        rows = [(n, np.dtype(t if not isinstance(t, tuple) else t[0]).name, comment)
+                for n, t, comment in self.fields(dfname)]
+        return pd.DataFrame(rows, columns=["Field name", "Data type", "Comment"])
+
+    def show_config(self, dfname):
+        self._wait()
+        return pd.DataFrame([
+            ("fake_rows", 10000, self.rows, dfname, "Rows per chunk"),
+            ("fake_samples", 200, self.samples, dfname, "Samples of array fields"),
+        ], columns=["option", "default", "current", "applies_to", "help"])
+
+    def scan_runs(self, after=None):
+        '''
+        The run table, only runs started after `after` (ns since the epoch) if given.
+        '''
+        self._wait()
+        if self._run_table is None:
+            self._run_table = generate_runs(self.runs)
+        if after is None:
+            return self._run_table.copy()
+        return self._run_table[self._run_table["start"] > pd.Timestamp(after)].reset_index(drop=True)
+
+    def get_array_iter(self, run_id, dfname):
+        fields = self.fields(dfname)
+        rng = np.random.RandomState(_seed(str(run_id), dfname))
+        t0 = 0
+        for _ in range(self.chunks):
+            arr = generate_chunk(fields, self.rows, rng, t0)
+            t0 = int(arr["endtime"].max())
+            self._wait(arr.nbytes)
+            yield arr
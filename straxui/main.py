@@ -1,9 +1,7 @@
 from os.path import dirname, join
-import os
 import pandas as pd
 from datetime import date
 from random import randint
-from concurrent.futures import ThreadPoolExecutor
 from bokeh.io import curdoc
 from bokeh.layouts import row, column, widgetbox
 from bokeh.models import ColumnDataSource
@@ -11,81 +9,108 @@ from bokeh.models.widgets import PreText, Select, Button, TextInput, DataTable,
 from bokeh.plotting import figure
 from bokeh.document import without_document_lock
 from tornado import gen
-from straxrpc.client import StraxClient
 from functools import partial
 from pages import page_classes
+from datalayer import get_data_layer
+import metrics
 import json
-import numpy as np
-from collections import defaultdict
+import time
 
-strax_addr = os.environ.get("STRAXRPC_ADDR", "localhost:50051")
-strax = StraxClient(strax_addr)
-try:
-    dataframe_names = strax.search_dataframe_names("*")
-except:
-    dataframe_names = ['event_basics']
+session_started = time.perf_counter()
+# process wide, created by server_lifecycle.py
+data_layer = get_data_layer()
+strax = data_layer.client()
+metadata = data_layer.metadata
+# never block session startup on the strax server, names arrive via follow_strax_server
+dataframe_names = metadata.peek(strax, "search_dataframe_names", "*") or ['event_basics']
 
 doc = curdoc()
-executor = ThreadPoolExecutor(max_workers=2)
+metrics.count("straxui_sessions_created_total")
+session_id = doc.session_context.id if doc.session_context is not None else str(id(doc))
+# shared by all sessions, separate from the load workers
+executor = data_layer.ui_executor
 
 with open(join(dirname(__file__), "data","plot_templates.json"), "rb") as f:
     plot_templates = {t["name"]:t for t in json.load(f)}
-random_src = {"x":np.arange(100), "y": 90*np.random.rand(100), 
-        "time":  10.*np.random.rand(100), "length":800.*np.random.rand(100),
-        "xs":[np.arange(10) for _ in range(100)], "ys": [90*np.random.rand(10) for _ in range(100)]}
-sources = defaultdict(list)
-sources["__random__"] = [random_src]
+sources = data_layer.cache
 
 
 shared_state = {
     "executor": executor, 
     "doc": doc,
+    "session_id": session_id,
     "dataframe_names": dataframe_names,
     "strax_ctx": strax,
     "plot_templates": plot_templates,
     "sources": sources,
+    "data_layer": data_layer,
+    "selection": None,
 }
 
 
-pages = []
-for klass in page_classes:
-    page = klass(shared_state)
-    pages.append(page)
+# pages are built when their tab is first opened, keyed by tab index
+pages = {}
 
-def update_pages():
-    try:
-        dataframe_names = strax.search_dataframe_names("*")
-    except:
-        dataframe_names = ['event_basics']
+def update_pages(dataframe_names):
+    if dataframe_names == shared_state["dataframe_names"]:
+        return
     shared_state["dataframe_names"] = dataframe_names
-
-    for p in pages:
+    for p in list(pages.values()):
         p.update()
 
-shared_state["update_pages"] = update_pages
-# tabs = Tabs(tabs=[explore_panel,load_data_panel, plot_data_panel, rpc_server_details])
-panels = []
-failed = []
-for page in pages:
-    try:
-       panels.append(Panel(child=page.create_page(), title=page.title) )
-    except:
-        failed.append(page)
-        print("failed to load {} page. ".format(page.title))
-update_pages()
-tabs = Tabs(tabs=panels)
-# def retry_failed(failed):
-#     refailed = []
-#     for page in failed:
-#         try:
-#             panel = Panel(child=page.create_page(), title=page.title)
-#             tabs.tabs.append(panel)
-#         except:
-#             refailed.append(page)
-#         if refailed:
-#             doc.add_timeout_callback(partial(retry_failed, refailed), 10000)
+def set_selection(selection):
+    shared_state["selection"] = selection
+    for p in list(pages.values()):
+        p.selection_changed(selection)
+
+def follow_strax_server():
+    metadata.subscribe(session_id, shared_state["strax_ctx"],
+                       lambda names: doc.add_next_tick_callback(partial(update_pages, names)))
+
+def refresh_pages():
+    with metrics.timer("straxui_callback_seconds", callback="refresh_pages"):
+        for p in list(pages.values()):
+            p.refresh()
+
+def build_tab(index):
+    '''
+    Construct the page of a tab and replace its placeholder, once.
+    Initial metadata requests of the page run on the executor.
+    '''
+    if index in pages or index >= len(page_classes):
+        return
+    klass = page_classes[index]
+    with metrics.timer("straxui_page_build_seconds", page=klass.title):
+        try:
+            page = klass(shared_state)
+            child = page.create_page()
+        except Exception as e:
+            print("failed to load {} page: {}".format(klass.title, e))
+            tabs.tabs[index].child = column(PreText(text="Failed to load this page: {}".format(e), width=600))
+            return
+        pages[index] = page
+        page.update()
+        page.refresh()
+        if shared_state["selection"] is not None:
+            page.selection_changed(shared_state["selection"])
+        tabs.tabs[index].child = child
+    if index == tabs.active and not first_tab_built[0]:
+        first_tab_built[0] = True
+        metrics.observe("straxui_session_first_tab_seconds", time.perf_counter() - session_started)
+
+def tab_changed(attr, old, new):
+    build_tab(new)
 
-# if failed:
-#     doc.add_timeout_callback(partial(retry_failed, failed), 10000)
-doc.add_periodic_callback(update_pages, 3000)
-doc.add_root(tabs)
\ No newline at end of file
+shared_state["update_pages"] = follow_strax_server
+shared_state["set_selection"] = set_selection
+# the shell with a placeholder per tab is sent right away, the open tab is built on the next tick
+tabs = Tabs(tabs=[Panel(child=column(PreText(text="Loading {}...".format(klass.title), width=600)), title=klass.title)
+                  for klass in page_classes])
+tabs.on_change("active", tab_changed)
+first_tab_built = [False]
+doc.add_next_tick_callback(partial(build_tab, tabs.active))
+follow_strax_server()
+# only looks at in-process state, metadata changes are pushed by follow_strax_server
+doc.add_periodic_callback(refresh_pages, 2000)
+doc.add_root(tabs)
+metrics.observe("straxui_session_startup_seconds", time.perf_counter() - session_started)
@@ -0,0 +1,129 @@
+"""
+Cached strax metadata shared by all sessions.
+Results of metadata RPCs (dataframe names, data_info, show_config) are kept
+for a TTL per (server address, call), at most max_entries of them with the
+least recently used dropped first. Dataframe names of every followed
+server are refreshed by a background thread and sessions are only notified
+when they actually changed.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+
+def _same(a, b):
+    if hasattr(a, "equals"):
+        try:
+            return a.equals(b)
+        except Exception:
+            return False
+    return a == b
+
+
+class MetadataService:
+    """
+    TTL cache for metadata RPCs with change notification for dataframe names.
+    """
+
+    def __init__(self, ttl=60, refresh_interval=10, max_entries=1000):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        # keys are arbitrary user input, e.g. search_field patterns, so keep them bounded
+        self._values = OrderedDict()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_environ(cls):
+        return cls(ttl=float(os.environ.get("STRAXUI_METADATA_TTL", 60)),
+                   refresh_interval=float(os.environ.get("STRAXUI_METADATA_REFRESH", 10)),
+                   max_entries=int(os.environ.get("STRAXUI_METADATA_MAX_ENTRIES", 1000)))
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                self._values.move_to_end(key)
+        return entry
+
+    def peek(self, ctx, method, *args):
+        '''
+        Returns the cached result (even if expired) or None, never blocks.
+        '''
+        entry = self._lookup((ctx.addr, method) + args)
+        return entry[1] if entry is not None else None
+
+    def get(self, ctx, method, *args):
+        '''
+        Returns the result of ctx.method(*args), calling the server
+        only if there is no cached value younger than the TTL.
+        Blocks on the RPC, so call it from an executor.
+        '''
+        entry = self._lookup((ctx.addr, method) + args)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return self._fetch(ctx, method, *args)[0]
+
+    def _fetch(self, ctx, method, *args):
+        with metrics.timer("straxui_rpc_seconds", method=method):
+            value = getattr(ctx, method)(*args)
+        key = (ctx.addr, method) + args
+        with self._lock:
+            old = self._values.pop(key, None)
+            self._values[key] = (time.monotonic(), value)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+        changed = old is None or not _same(old[1], value)
+        return value, changed
+
+    def subscribe(self, owner, ctx, callback):
+        '''
+        Call callback(dataframe_names) from a background thread whenever
+        the dataframe names of ctx's server change. If names are already
+        known, callback is called right away. One subscription per owner.
+        '''
+        with self._lock:
+            self._subscribers[owner] = (ctx, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._thread.start()
+        names = self.peek(ctx, "search_dataframe_names", "*")
+        if names is not None:
+            callback(names)
+        self._wake.set()
+
+    def unsubscribe(self, owner):
+        with self._lock:
+            self._subscribers.pop(owner, None)
+
+    def refresh(self):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        clients = {ctx.addr: ctx for ctx, _ in subscribers}
+        for addr, ctx in clients.items():
+            try:
+                names, changed = self._fetch(ctx, "search_dataframe_names", "*")
+            except Exception as e:
+                print("failed to refresh dataframe names from {}: {}".format(addr, e))
+                continue
+            if not changed:
+                continue
+            for sub_ctx, callback in subscribers:
+                if sub_ctx.addr == addr:
+                    callback(names)
+
+    def _refresh_loop(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            self.refresh()
+            self._wake.wait(self.refresh_interval)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
@@ -0,0 +1,185 @@
+"""
+Process wide timers, counters and gauges for the hot paths of the server.
+Recording is a dict lookup and a few additions under a lock, cheap enough
+to leave on everywhere. Values are shown on the Metrics page and served in
+the Prometheus text format at /metrics (see serve.py), e.g.
+
+    with metrics.timer("straxui_rpc_seconds", method="data_info"):
+        ctx.data_info(name)
+"""
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from bokeh.util.serialization import BINARY_ARRAY_TYPES
+from tornado import web
+
+# upper bounds of the histogram buckets, seconds for timers
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., float("inf"))
+size_buckets = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    """
+    Metrics keyed by (name, sorted labels).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=default_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, func, **labels):
+        '''
+        Register func() to be called whenever metrics are collected.
+        '''
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = func
+
+    def _gauge_values(self):
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = []
+        for key, func in gauges:
+            try:
+                values.append((key, float(func())))
+            except Exception:
+                continue
+        return values
+
+    def rows(self):
+        '''
+        One dict per metric for display, sorted by name.
+        '''
+        rows = []
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                rows.append({"name": name, "labels": _labels(labels), "type": "counter",
+                             "count": value, "mean": None, "max": None, "total": value})
+            for (name, labels), h in self._histograms.items():
+                rows.append({"name": name, "labels": _labels(labels), "type": "histogram",
+                             "count": h.count, "mean": h.sum/h.count if h.count else 0., "max": h.max, "total": h.sum})
+        for (name, labels), value in self._gauge_values():
+            rows.append({"name": name, "labels": _labels(labels), "type": "gauge",
+                         "count": None, "mean": None, "max": None, "total": value})
+        return sorted(rows, key=lambda r: (r["name"], r["labels"]))
+
+    def render(self):
+        '''
+        All metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        typed = set()
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} {}".format(name, kind))
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (h.buckets, list(h.counts), h.count, h.sum)) for k, h in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append("{}{} {}".format(name, _labels(labels, braces=True), value))
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(name, _labels(labels + (("le", le),), braces=True), cumulative))
+            lines.append("{}_sum{} {}".format(name, _labels(labels, braces=True), total))
+            lines.append("{}_count{} {}".format(name, _labels(labels, braces=True), count))
+        for (name, labels), value in sorted(self._gauge_values()):
+            header(name, "gauge")
+            lines.append("{}{} {}".format(name, _labels(labels, braces=True), value))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, braces=False):
+    text = ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels)
+    if braces:
+        return "{" + text + "}" if text else ""
+    return text
+
+
+registry = Registry()
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+gauge = registry.gauge
+
+
+def value_nbytes(values):
+    '''
+    Bytes a column takes on the wire, arrays bokeh sends as binary by their
+    buffer and everything else as JSON, estimated from the first values.
+    '''
+    if isinstance(values, np.ndarray):
+        if values.dtype in BINARY_ARRAY_TYPES:
+            return values.nbytes
+        sample = values.ravel()[:100]
+        return values.size*(sum(len(str(v)) for v in sample.tolist())/max(len(sample), 1) + 1)
+    if isinstance(values, (list, tuple)):
+        return sum(value_nbytes(v) for v in values)
+    return 8
+
+
+def data_nbytes(data):
+    '''
+    Approximate size of ColumnDataSource data as sent to the browser.
+    '''
+    return int(sum(value_nbytes(values) for values in data.values()))
+
+
+def observe_push(data, kind):
+    '''
+    Record the size of data about to be sent to the browser.
+    '''
+    observe("straxui_push_bytes", data_nbytes(data), buckets=size_buckets, kind=kind)
+    return data
+
+
+class MetricsHandler(web.RequestHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(registry.render())
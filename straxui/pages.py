@@ -1,33 +1,30 @@
-import pandas as pd
 from datetime import date
 from random import randint
 from concurrent.futures import ThreadPoolExecutor
 from bokeh.io import curdoc
 from bokeh.layouts import row, column, widgetbox
-from bokeh.models import ColumnDataSource, CustomJS
-from bokeh.models.widgets import PreText, Select, Button, TextInput, DataTable, DateFormatter, TableColumn, Tabs, Panel, NumberEditor, Slider
+from bokeh.models import ColumnDataSource, CustomJS, DataRange1d, Range1d, LinearColorMapper
+from bokeh.models.widgets import PreText, Select, Button, TextInput, DataTable, DateFormatter, TableColumn, Tabs, Panel, NumberEditor, Slider, MultiSelect, Toggle
 from bokeh.plotting import figure
 from bokeh.palettes import Spectral5, Plasma256
-from bokeh.document import without_document_lock
-from tornado import gen
+from bokeh.events import SelectionGeometry, Reset
 # from straxrpc.client import StraxClient
 from functools import partial
 from copy import copy
 import json
 import numpy as np
 import time
-
-class TypeTester:
-   
-    def array(self,s):
-        return isinstance(s, (list, np.ndarray))
-
-    
-    def scalar(self,s):
-        if isinstance(s, str):
-            return False
-        return np.isscalar(s)
-
+import threading
+from chunks import source_data
+from table import TableView
+from downsample import DownsampledGlyph, data_range, pad_range
+from categories import CategoryMapping
+import aggregate
+import metrics
+from expressions import ExpressionError, Cut, CutCount, parse_definition
+from selection import Selection
+from catalog import QueryError
+import waveforms
 
 class Page:
     """
@@ -61,6 +58,75 @@ class Page:
         '''
         pass
 
+    def refresh(self):
+        '''
+        This method is called periodically to pick up changes of process local state
+        like the loaded sources. Must not block and should only touch widgets that changed.
+        '''
+        pass
+
+    def selection_changed(self, selection):
+        '''
+        This method is called when a plot selection is made or cleared (None).
+        '''
+        pass
+
+    def current_selection(self):
+        '''
+        Return the plot selection if it was drawn on the source this page shows, else None.
+        '''
+        selection = self.shared_state.get("selection")
+        if selection is not None and selection.name == getattr(self, "current_name", None):
+            return selection
+        return None
+
+    def define_column(self, source, text):
+        '''
+        Add "name = expression" (or just an expression) as a column of a loaded
+        source and return its name. Raises ExpressionError or KeyError.
+        '''
+        sources = self.shared_state["sources"]
+        name, expression = parse_definition(text)
+        known = sources.expressions(source)
+        if name in known and known[name].text == expression.text:
+            return name
+        schema = sources.schema(source)
+        if name == expression.text and schema is not None and name in schema and name not in known:
+            # a plain column
+            return name
+        sources.add_expression(source, name, expression)
+        return name
+
+    def submit(self, callback, func, *args):
+        '''
+        Run the blocking func(*args) on the executor and call callback(result)
+        on the document thread once it is done. Exceptions are passed as the result.
+        '''
+        doc = self.shared_state["doc"]
+        task = getattr(func, "__name__", "task")
+        submitted = time.perf_counter()
+        def run():
+            metrics.observe("straxui_task_wait_seconds", time.perf_counter() - submitted, page=self.title)
+            with metrics.timer("straxui_task_seconds", page=self.title, task=task):
+                return func(*args)
+        def finish(result):
+            with metrics.timer("straxui_callback_seconds", callback=getattr(getattr(callback, "func", callback), "__name__", "callback")):
+                callback(result)
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            doc.add_next_tick_callback(partial(finish, result))
+        self.shared_state["executor"].submit(run).add_done_callback(done)
+
+    def metadata(self, callback, method, *args):
+        '''
+        Fetch strax metadata (memoized per server address) without blocking the document.
+        '''
+        ctx = self.shared_state.get("strax_ctx")
+        self.submit(callback, self.shared_state["data_layer"].metadata.get, ctx, method, *args)
+
 class ExplorePage(Page):
     """
 
@@ -79,17 +145,30 @@ class ExplorePage(Page):
         self.df_table = DataTable(source=self.df_source, columns=columns, width=600, height=300, editable=False)
 
     def build_pattern_search(self):
-        def pattern_changed(attr, old, new):
-            ctx = self.shared_state.get("strax_ctx")
-            try:
-                matches = ctx.search_field(new)
-            except:
-                matches = []
-            if matches:
+        def show_matches(pattern, matches):
+            if pattern != self.pattern_selector.value:
+                # a newer search is on its way
+                return
+            if matches and not isinstance(matches, Exception):
                 self.pattern_result_display.text = '\n'.join(matches)
             else:
                 self.pattern_result_display.text = 'No Matches to show.'
-        
+
+        def search(pattern):
+            self.pending_search = None
+            self.metadata(partial(show_matches, pattern), "search_field", pattern)
+
+        def pattern_changed(attr, old, new):
+            # wait for the user to stop typing before asking the server
+            doc = self.shared_state["doc"]
+            if self.pending_search is not None:
+                try:
+                    doc.remove_timeout_callback(self.pending_search)
+                except ValueError:
+                    pass
+            self.pending_search = doc.add_timeout_callback(partial(search, new), 300)
+
+        self.pending_search = None
         self.pattern_selector.on_change('value', pattern_changed)
         self.pattern_selector.value = "s1*"
         
@@ -97,14 +176,18 @@ class ExplorePage(Page):
 
     
     def build_data_info(self):
+        def show_data_info(name, df):
+            if name != self.dataframe_selector.value:
+                return
+            if isinstance(df, Exception):
+                self.df_title.text = 'Failed to load columns for {}: {}'.format(name, df)
+                return
+            self.df_title.text = 'Columns for {}:'.format(name)
+            self.df_source.data = df.astype("str").to_dict(orient='list')
+
         def dataframe_changed(attr, old, new):
-            self.df_title.text = 'Columns for {}:'.format(new)
-            try:
-                ctx = self.shared_state.get("strax_ctx")
-                df = ctx.data_info(new)
-                self.df_source.data = df.astype("str").to_dict(orient='list')
-            except:
-                pass
+            self.df_title.text = 'Loading columns for {}...'.format(new)
+            self.metadata(partial(show_data_info, new), "data_info", new)
         self.dataframe_selector.on_change('value', dataframe_changed)
         self.dataframe_selector.value = self.dataframe_selector.options[0]
         return column(self.dataframe_selector, self.df_title, self.df_table)
@@ -124,23 +207,53 @@ class LoadDataPage(Page):
     title = "Load Tables"
     def init(self):
         self.dataframe_names = self.shared_state.get('dataframe_names')
-        self.run_id_selector = Select(title="Run ID:", value="170621_0617", options=["170621_0617", "180423_1021"], width=200)
+        # a page of the runs matching run_search, see catalog.py for the query syntax
+        self.run_search = TextInput(title="Find runs (e.g. 1804 tag:sciencerun1 has:peaks)", value="", width=300)
+        self.run_id_selector = Select(title="Run ID:", value="", options=[], width=200)
+        self.run_prev_button = Button(label="<", width=40, disabled=True)
+        self.run_next_button = Button(label=">", width=40, disabled=True)
+        self.run_status = PreText(text="", width=300, height=20)
+        self.run_page = 0
+        self.run_page_size = 50
         # self.load_dataframe_selector = Select(title="Dataframe", value="", options=self.dataframe_names)
         self.dataframe_selector = Select(title="Dataframe", value="", options=self.dataframe_names, width=200)
         if len(self.dataframe_names):
             self.dataframe_selector.value = self.dataframe_names[0]
         self.load_df_button = Button(label="Load", button_type="primary", width=150)
-        self.download_df_button = Button(label="Download table as CSV", button_type="primary", width=150)
+        # partial loads, only these fields and rows within the window are fetched
+        self.load_fields_selector = MultiSelect(title="Fields (all if none selected)", value=[], options=[], width=200, height=120)
+        self.window_start = TextInput(title="From [s after first row]", value="", width=150)
+        self.window_stop = TextInput(title="To [s after first row]", value="", width=150)
+        self.download_df_button = Button(label="Download table", button_type="primary", width=150)
         self.download_df_button.disabled = True
+        self.download_format_selector = Select(value="csv", options=["csv", "parquet"], width=80)
 
         df_column_names = ['column 1', 'column 2', 'columns 3']
         self.df_source = ColumnDataSource({name:[] for name in df_column_names})
         columns = [TableColumn(field=name, title=name) for name in df_column_names]
-        self.df_table = DataTable(source=self.df_source, columns=columns, width=1200, height=400, editable=False)
+        # sorting and filtering happens on the server, the browser only gets the current page
+        self.df_table = DataTable(source=self.df_source, columns=columns, width=1000, height=400, editable=False, sortable=False)
+        self.table_column_selector = MultiSelect(title="Table columns", value=[], options=[], width=190, height=400)
+        self.table_view = TableView(page_size=100)
+        self.page_position = Slider(start=0, end=1, value=0, step=1, title="Page", disabled=True, width=200)
+        self.next_page_button = Button(label="Next page", button_type="primary", width=80)
+        self.back_page_button = Button(label="Prev page", button_type="primary", width=80)
+        self.sort_selector = Select(title="Sort by", value="None", options=["None"], width=150)
+        self.sort_order_selector = Select(title="Order", value="ascending", options=["ascending", "descending"], width=100)
+        self.filter_column_selector = Select(title="Filter column", value="None", options=["None"], width=150)
+        self.filter_min = TextInput(title="Min", value="", width=100)
+        self.filter_max = TextInput(title="Max", value="", width=100)
+        self.apply_filter_button = Button(label="Apply filter", button_type="primary", width=100)
+        self.clear_filter_button = Button(label="Clear filters", button_type="warning", width=100)
+        self.cut_input = TextInput(title="Cut expression", value="", width=250)
+        self.table_status = PreText(text="", width=600, height=20)
         self.next_button = Button(label="Next >>", button_type="primary", width=50, disabled = True)
         self.back_button = Button(label="<< Prev", button_type="primary", width=50, disabled = True)
         self.current_position = Slider(start=0, end=2, value=0, step=1, title="Chunk", disabled=True, width=200)
         self.current_name = ""
+        self.cancel_load_button = Button(label="Cancel", button_type="danger", width=100, disabled=True)
+        self.load_status = PreText(text="", width=1000, height=20)
+        self.current_load = None
 
     def build_selection_bar(self):
         def disable_button():
@@ -157,9 +270,10 @@ class LoadDataPage(Page):
                 self.current_name = name
                 new = idx%len(srcs)
                 self.current_position.end = len(srcs)
-                data = srcs[new]
+                self.table_view.set_chunk(srcs[new])
+                self.table_view.set_mask("selection", self.current_selection())
                 self.current_position.value = new
-                self.df_source.data = data
+                self.show_table_page(0)
                 if new:
                     self.back_button.disabled = False
                 else:
@@ -178,59 +292,96 @@ class LoadDataPage(Page):
                 
                 enable_button()
 
-        def save_source(name, data):
-            #data = {k: [] for k in keys} #df.to_dict(orient='list')
-            # name = "{}_{}".format(self.dataframe_selector.value, self.run_id_selector.value)
-            self.shared_state['sources'][name].append(data)
-
-        def reset_source(keys):
-            data = {k: [] for k in keys}
+        def reset_source(name):
+            # derived columns are only computed once selected for the table
+            schema = self.shared_state['sources'].schema(name)
+            keys = schema.fields + ["_index"]
+            self.table_column_selector.options = schema.names()
+            self.table_column_selector.value = keys
             self.df_table.columns = [TableColumn(field=n, title=n) for n in keys]
-            self.df_source.data = data
+            self.df_source.data = {k: [] for k in keys}
             self.current_position.value = 0
+            scalars = schema.names("scalar")
+            self.sort_selector.options = ["None"] + scalars
+            self.filter_column_selector.options = ["None"] + scalars
+            self.table_view.sort(None)
+            self.table_view.clear_filters()
             
-        def stream_array(doc, ctx, run_id, dfname):
-            try:
-                name = "{}_{}".format(dfname, run_id)
-                for i, arr in enumerate(ctx.get_array_iter(run_id, dfname)):
-                    data = {n: arr[n].tolist() for n in arr.dtype.names}
-                    first_born = {k:v[0] for k,v in data.items()}
-                    # FIXME: there must be a better way
-                    for n, v in first_born.items():
-                        if not np.isscalar(v):
-                            data['mean({})'.format(n)] = np.mean(data[n], axis=1)
-                            data['std({})'.format(n)] = np.std(data[n], axis=1)
-                            data['index({})'.format(n)] =  [np.arange(len(x)) for x in data[n]]
-                    data["_index"] = np.arange(len(data[n]))
-                    doc.add_next_tick_callback(partial(save_source, name, data))
-                    if not i:
-                        doc.add_next_tick_callback(partial(reset_source, list(data)))
-                        doc.add_next_tick_callback(partial(switch_table_source, name, 0))
-           
-            except Exception as e:
-                print(e)
-            finally:
-                doc.add_next_tick_callback(enable_button)
+        def chunk_arrived(load, idx):
+            if load is not self.current_load:
+                return
+            if not idx:
+                reset_source(load.name)
+                switch_table_source(load.name, 0)
+            else:
+                self.current_position.end = len(self.shared_state['sources'][load.name])
+            self.load_status.text = "Loading {}: {}".format(load.name, load.stats)
+
+        def load_finished(load):
+            if load is not self.current_load:
+                return
+            if load.error is None:
+                self.load_status.text = "Loaded {}: {}".format(load.name, load.stats)
+                # the export handler streams the source from the cache, only once it is complete
+                self.download_df_button.tags = [load.name]
+                self.download_df_button.disabled = False
+            else:
+                self.load_status.text = "Failed to load {}: {}".format(load.name, load.error)
+                self.download_df_button.disabled = True
+            self.cancel_load_button.disabled = True
+            enable_button()
 
-        @gen.coroutine
-        @without_document_lock
         def load_dataframe_pressed():
             doc = self.shared_state.get('doc')
-            executor = self.shared_state.get('executor')
+            data_layer = self.shared_state.get('data_layer')
+            session_id = self.shared_state.get('session_id')
             ctx = self.shared_state.get("strax_ctx")
             dfname = self.dataframe_selector.value
-            run_id = self.run_id_selector.value
-            # info = ctx.data_info(dfname)
-            name = "{}_{}".format(dfname, run_id)
-            
-            if name in self.shared_state['sources']:
-                doc.add_next_tick_callback(partial(switch_table_source, name))
-            else:
-                yield executor.submit(stream_array, doc, ctx, run_id, dfname)
-            # else:
-            #     yield executor.submit(stream_df, doc, ctx, run_id, dfname)
-    
+            # without a run catalog the search text is taken as run id
+            run_id = self.run_id_selector.value or self.run_search.value.strip()
+            try:
+                seconds_range = self.seconds_range()
+            except ValueError as e:
+                self.load_status.text = str(e)
+                doc.add_next_tick_callback(enable_button)
+                return
+            if not run_id:
+                self.load_status.text = "Select a run to load"
+                doc.add_next_tick_callback(enable_button)
+                return
+            # loads are shared with other sessions, this one just follows along
+            load = data_layer.load(ctx, run_id, dfname, self.load_fields_selector.value, seconds_range)
+            previous, self.current_load = self.current_load, load
+            if previous is not None and previous is not load:
+                # superseded, stops the previous load unless another session follows it
+                previous.unsubscribe(session_id)
+            self.cancel_load_button.disabled = False
+            self.download_df_button.disabled = True
+            self.load_status.text = "Loading {}...".format(load.name)
+            load.subscribe(session_id, lambda idx: doc.add_next_tick_callback(partial(chunk_arrived, load, idx)),
+                           lambda load: doc.add_next_tick_callback(partial(load_finished, load)))
+
+        def cancel_load_pressed():
+            load, self.current_load = self.current_load, None
+            if load is None:
+                return
+            load.unsubscribe(self.shared_state.get('session_id'))
+            self.load_status.text = "Cancelled loading {} after {}".format(load.name, load.stats)
+            if load.name not in self.shared_state['sources']:
+                self.download_df_button.disabled = True
+            self.cancel_load_button.disabled = True
+            enable_button()
+        self.cancel_load_button.on_click(cancel_load_pressed)
+
         self.load_df_button.on_click(load_dataframe_pressed)
+        # served by export.ExportHandler (see serve.py), the download never goes through the document
+        self.download_df_button.js_on_click(CustomJS(
+            args=dict(button=self.download_df_button, fmt=self.download_format_selector, columns=self.table_column_selector),
+            code="""
+            var params = "source=" + encodeURIComponent(button.tags[0]) + "&format=" + fmt.value
+                + "&columns=" + encodeURIComponent(columns.value.join(","));
+            window.open("/export?" + params);
+            """))
         self.load_df_button.on_click(disable_button)
 
         def next_pressed():
@@ -240,15 +391,207 @@ class LoadDataPage(Page):
             switch_table_source(self.current_name, self.current_position.value-1)
         self.back_button.on_click(back_pressed)
 
-        selectors = row(widgetbox(self.dataframe_selector), widgetbox(self.run_id_selector),widgetbox(self.load_df_button),widgetbox(self.download_df_button), width=1200)
+        partial_load = self.build_partial_load()
+        selectors = row(widgetbox(self.dataframe_selector), self.build_run_picker(),widgetbox(self.load_df_button),widgetbox(self.cancel_load_button, width=120),widgetbox(self.download_df_button),widgetbox(self.download_format_selector, width=100), width=1200)
         buttons = row( widgetbox(self.back_button),
         widgetbox( self.current_position), widgetbox(self.next_button),  width=1000)
         
         
-        return column(selectors, buttons, width=1200)
+        return column(selectors, partial_load, buttons, widgetbox(self.load_status, width=1000), width=1200)
+
+    def seconds_range(self):
+        '''
+        The (start, stop) window entered in seconds, None for the whole run.
+        '''
+        bounds = []
+        for widget in (self.window_start, self.window_stop):
+            text = widget.value.strip()
+            try:
+                bounds.append(float(text) if text else None)
+            except ValueError:
+                raise ValueError("{} is not a number of seconds".format(text))
+        if bounds == [None, None]:
+            return None
+        if None not in bounds and bounds[1] <= bounds[0]:
+            raise ValueError("the time window ends before it starts")
+        return tuple(bounds)
+
+    def build_partial_load(self):
+        def show_fields(name, df):
+            if name != self.dataframe_selector.value:
+                return
+            if isinstance(df, Exception):
+                self.load_status.text = "Failed to get the fields of {}, loading all of them: {}".format(name, df)
+                return
+            self.load_fields_selector.options = df["Field name"].astype(str).tolist()
+            self.load_fields_selector.value = []
+
+        def dataframe_changed(attr, old, new):
+            self.load_fields_selector.options = []
+            self.load_fields_selector.value = []
+            if new:
+                self.metadata(partial(show_fields, new), "data_info", new)
+        self.dataframe_selector.on_change("value", dataframe_changed)
+        dataframe_changed("value", None, self.dataframe_selector.value)
+        return row(widgetbox(self.load_fields_selector, width=220), widgetbox(self.window_start, width=170),
+                   widgetbox(self.window_stop, width=170), width=1200)
+
+    def catalog(self):
+        return self.shared_state["data_layer"].catalog(self.shared_state["strax_ctx"])
+
+    def show_runs(self):
+        '''
+        Show the current page of runs matching the search, queries are answered from the in-memory index.
+        '''
+        catalog = self.catalog()
+        try:
+            total, names = catalog.query(self.run_search.value, self.run_page*self.run_page_size, self.run_page_size)
+        except QueryError as e:
+            self.run_status.text = str(e)
+            return
+        if self.run_page and self.run_page*self.run_page_size >= total:
+            # fewer matches than before, e.g. after a refresh
+            self.run_page = max(0, -(-total//self.run_page_size) - 1)
+            self.show_runs()
+            return
+        if not len(catalog):
+            self.run_status.text = "Loading runs..." if catalog.error is None and catalog.updated is None else "No run list, enter a run id"
+        elif not total:
+            self.run_status.text = "No matching runs of {}".format(len(catalog))
+        else:
+            start = self.run_page*self.run_page_size
+            self.run_status.text = "{}-{} of {} runs".format(start+1, start+len(names), total)
+        if names != self.run_id_selector.options:
+            self.run_id_selector.options = names
+        if self.run_id_selector.value not in names:
+            self.run_id_selector.value = names[0] if names else ""
+        self.run_prev_button.disabled = self.run_page == 0
+        self.run_next_button.disabled = (self.run_page+1)*self.run_page_size >= total
+
+    def refresh_catalog(self):
+        '''
+        Fetch the run list of the strax server on the executor when it is older than its refresh interval.
+        '''
+        catalog = self.catalog()
+        if not catalog.stale:
+            return
+        def refreshed(changes):
+            if isinstance(changes, Exception):
+                print("failed to refresh the run catalog: {}".format(changes))
+            if catalog is self.catalog():
+                self.show_runs()
+        self.submit(refreshed, catalog.refresh, self.shared_state["strax_ctx"])
+
+    def build_run_picker(self):
+        def search():
+            self.pending_run_search = None
+            self.run_page = 0
+            self.show_runs()
+
+        def search_changed(attr, old, new):
+            # wait for the user to stop typing
+            doc = self.shared_state["doc"]
+            if self.pending_run_search is not None:
+                try:
+                    doc.remove_timeout_callback(self.pending_run_search)
+                except ValueError:
+                    pass
+            self.pending_run_search = doc.add_timeout_callback(search, 200)
+        self.pending_run_search = None
+        self.run_search.on_change("value", search_changed)
+
+        def next_pressed():
+            self.run_page += 1
+            self.show_runs()
+        self.run_next_button.on_click(next_pressed)
+
+        def prev_pressed():
+            self.run_page = max(self.run_page-1, 0)
+            self.show_runs()
+        self.run_prev_button.on_click(prev_pressed)
+
+        self.show_runs()
+        self.refresh_catalog()
+        return column(widgetbox(self.run_search, width=320),
+                      row(widgetbox(self.run_id_selector, width=220), widgetbox(self.run_prev_button, width=50),
+                          widgetbox(self.run_next_button, width=50)),
+                      widgetbox(self.run_status, width=320))
+
+    def show_table_page(self, number):
+        view = self.table_view
+        if view.chunk is None:
+            return
+        number = min(max(number, 0), view.n_pages-1)
+        self.df_source.data = view.page(number, self.table_column_selector.value)
+        self.page_position.end = max(view.n_pages-1, 1)
+        self.page_position.value = number
+        self.page_position.disabled = view.n_pages < 2
+        first = number*view.page_size
+        text = "Rows {}-{} of {}".format(min(first+1, view.n_rows), min(first+view.page_size, view.n_rows), view.n_rows)
+        if view.filters or view.masks:
+            text += " (filtered from {})".format(len(view.chunk))
+        selection = view.masks.get("selection")
+        if selection is not None and selection.applies_to(view.chunk):
+            text += ", selected {}".format(selection)
+        self.table_status.text = text
 
     def build_table(self):
-        return widgetbox(self.df_table)
+        def table_columns_changed(attr, old, new):
+            self.df_table.columns = [TableColumn(field=n, title=n) for n in new]
+            self.show_table_page(self.page_position.value)
+        self.table_column_selector.on_change("value", table_columns_changed)
+
+        def page_changed(attr, old, new):
+            self.show_table_page(new)
+        self.page_position.on_change("value", page_changed)
+        self.next_page_button.on_click(lambda: self.show_table_page(self.page_position.value+1))
+        self.back_page_button.on_click(lambda: self.show_table_page(self.page_position.value-1))
+
+        def sort_changed(attr, old, new):
+            column = self.sort_selector.value
+            self.table_view.sort(None if column == "None" else column, self.sort_order_selector.value == "ascending")
+            self.show_table_page(0)
+        self.sort_selector.on_change("value", sort_changed)
+        self.sort_order_selector.on_change("value", sort_changed)
+
+        def parse_bound(text):
+            try:
+                return float(text)
+            except ValueError:
+                return None
+
+        def apply_filter():
+            column = self.filter_column_selector.value
+            if column != "None":
+                self.table_view.set_filter(column, parse_bound(self.filter_min.value), parse_bound(self.filter_max.value))
+            cut = self.cut_input.value.strip()
+            if cut and self.current_name:
+                try:
+                    # the cut becomes a column of the source, evaluated per chunk and cached with it
+                    name = self.define_column(self.current_name, cut)
+                except (ExpressionError, KeyError) as e:
+                    self.table_status.text = "Invalid cut: {}".format(e)
+                    return
+                self.table_view.set_mask("cut", Cut(name))
+                self.table_column_selector.options = self.shared_state["sources"].schema(self.current_name).names()
+            else:
+                self.table_view.set_mask("cut", None)
+            self.show_table_page(0)
+        self.apply_filter_button.on_click(apply_filter)
+
+        def clear_filters():
+            self.table_view.clear_filters()
+            self.table_view.set_mask("cut", None)
+            self.cut_input.value = ""
+            self.show_table_page(0)
+        self.clear_filter_button.on_click(clear_filters)
+
+        paging = row(widgetbox(self.back_page_button, width=100), widgetbox(self.page_position), widgetbox(self.next_page_button, width=100),
+                     widgetbox(self.table_status, width=600))
+        query = row(widgetbox(self.sort_selector, width=170), widgetbox(self.sort_order_selector, width=120),
+                    widgetbox(self.filter_column_selector, width=170), widgetbox(self.filter_min, width=120), widgetbox(self.filter_max, width=120),
+                    widgetbox(self.cut_input, width=270), widgetbox(self.apply_filter_button, width=120), widgetbox(self.clear_filter_button, width=120))
+        return column(query, paging, row(widgetbox(self.df_table, width=1000), widgetbox(self.table_column_selector, width=200)))
         
     def create_page(self):
         selection_bar = self.build_selection_bar()
@@ -257,6 +600,16 @@ class LoadDataPage(Page):
 
     def update(self):
         self.dataframe_selector.options = self.shared_state.get('dataframe_names')
+        # the strax server may have changed
+        self.show_runs()
+        self.refresh_catalog()
+
+    def refresh(self):
+        self.refresh_catalog()
+
+    def selection_changed(self, selection):
+        self.table_view.set_mask("selection", self.current_selection())
+        self.show_table_page(0)
 
 class PlotColumnsPage(Page):
     title = "Plot Columns"
@@ -278,6 +631,29 @@ class PlotColumnsPage(Page):
         self.column_selectors_group = column()
         self.plot_button = Button(label="Plot", button_type="primary", width=150)
         self.plot_layout = column()
+        self.plot_columns = None
+        self.source_used = False
+        self.categories = []
+        self.downsampled = []
+        self.live_toggle = Toggle(label="Live", active=False, width=80)
+        self.selection_info = PreText(text="", width=600, height=20)
+        self.expression_input = TextInput(title="New column (name = expression)", value="", width=250)
+        self.add_expression_button = Button(label="Add column", button_type="primary", width=150)
+        self.cut_input = TextInput(title="Cut expression", value="", width=250)
+        self.expression_status = PreText(text="", width=250, height=40)
+        self.cut = None
+        self.cut_count = None
+        self.selection_columns = None
+        self.selection_count = None
+        self.live_load = None
+        self.live_chunks = set()
+        self.aggregations = []
+        self.aggregate_texts = {}
+        self.category_mappings = {}
+        self.aggregate_info = PreText(text="", width=600, height=80)
+        self.waveforms = []
+        self.encoding = None
+        self.waveform_info = PreText(text="", width=600, height=20)
         # self.update()
     
 
@@ -304,15 +680,12 @@ class PlotColumnsPage(Page):
             self.plot_template_selector.value = list(self.templates)[0]
 
         def source_changed(attr, old, new):
-            #FIXME implement caching of options and choices
-            srcs = self.shared_state["sources"][new]
-            if not srcs:
+            schema = self.shared_state["sources"].schema(new)
+            if schema is None:
                 return
-            src = srcs[0]
-            self.current_position.end = len(srcs)
+            self.current_position.end = schema.chunks
             # columns = self.numeric_columns(new)
             # print(columns)
-            tester = TypeTester()
             sidx = 0
             for g in self.template["glyphs"]:
                 for options in g["selector_options"].values():
@@ -320,17 +693,19 @@ class PlotColumnsPage(Page):
                     kwarg = options["kwarg"]
                     selector = self.column_selectors[sidx]
                     sidx+=1
-                    test = getattr(tester, supports)
-                    columns = [col for col in src if test(src[col][0])]
+                    columns = schema.names(supports)
                     if kwarg in g["essential"]:
                         selector.options = columns
                     else:
                         selector.options = ["None"] + columns
 
+                    default = g["kwargs"].get(kwarg)
                     if selector.value in columns:
                         pass
                     elif kwarg in columns:
                         selector.value = kwarg
+                    elif isinstance(default, str) and default in columns:
+                        selector.value = default
                     else:
                         selector.value = "None"
                     # FIXME: Make this error proof
@@ -339,9 +714,67 @@ class PlotColumnsPage(Page):
         self.src_selector.value = "__random__"
 
         self.plot_button.on_click(self.build_plot)
+
+        def add_expression_pressed():
+            name = self.src_selector.value
+            try:
+                column = self.define_column(name, self.expression_input.value)
+            except (ExpressionError, KeyError) as e:
+                self.expression_status.text = "Invalid column: {}".format(e)
+                return
+            self.expression_status.text = "Added {} to {}".format(column, name)
+            # update the column selectors
+            self.src_selector.value = ""
+            self.src_selector.value = name
+        self.add_expression_button.on_click(add_expression_pressed)
+
         data_loading = column(widgetbox(self.plot_template_selector, self.src_selector))
+        expressions = widgetbox(self.expression_input, self.add_expression_button, self.cut_input, self.expression_status)
         self.column_selectors_group.children = [widgetbox(s) for s in self.column_selectors]
-        return column(data_loading, self.column_selectors_group)
+        return column(data_loading, self.column_selectors_group, expressions)
+
+    def category_mapping(self, name, column, cats):
+        '''
+        Bins of a column of a source, the distinct values of the source if
+        there are few, else quantiles of its first chunk. Reused for all
+        chunks so the same value always gets the same category.
+        '''
+        key = (name, column, tuple(cats))
+        if key not in self.category_mappings:
+            sources = self.shared_state["sources"]
+            schema = sources.schema(name)
+            info = schema.columns.get(column) if schema is not None else None
+            self.category_mappings[key] = CategoryMapping(sources[name][0][column], cats, info)
+        return self.category_mappings[key]
+
+    def chunk_columns(self, chunk, categories):
+        '''
+        Full length columns of a chunk needed by the plot, including mapped categories.
+        '''
+        columns = {n: chunk[n] for n in self.plot_columns}
+        for col, name, mapping in categories:
+            columns[name] = mapping.column(chunk[col])
+        if self.cut is not None and self.cut.applies_to(chunk):
+            mask = self.cut.mask(chunk)
+            columns = {n: values[mask] for n, values in columns.items()}
+        return columns
+
+    def show_waveforms(self, chunk):
+        '''
+        Draw the rows of a chunk passing the cut and inside the selection on the waveform glyphs.
+        '''
+        if not self.waveforms:
+            return
+        mask = np.ones(len(chunk), dtype=bool)
+        if self.cut is not None and self.cut.applies_to(chunk):
+            mask &= self.cut.mask(chunk)
+        selection = self.current_selection()
+        if selection is not None and selection.applies_to(chunk):
+            mask &= selection.mask(chunk)
+        rows = np.flatnonzero(mask)
+        for glyph in self.waveforms:
+            glyph.show(chunk, rows)
+        self.waveform_info.text = "\n".join(str(glyph) for glyph in self.waveforms)
 
     def build_plot(self):
         fig = figure(**self.figure_kwargs)
@@ -353,42 +786,305 @@ class PlotColumnsPage(Page):
             
         idx = self.current_position.value
         if idx<len(srcs) and srcs:
-            data = srcs[idx]
             self.next_button.disabled = False
             self.current_position.disabled = False
         else:
-            data = srcs[0]
-        self.source.data = data
-        df = self.source.to_df()
-        soptions = []
+            idx = 0
+        chunk = srcs[idx]
+        # only the selected columns are computed and sent
+        selected = []
+        sidx = 0
+        for g in self.template["glyphs"]:
+            for _ in g["selector_options"]:
+                value = self.column_selectors[sidx].value
+                sidx+=1
+                # waveform glyphs read their columns from the chunk, never as row lists
+                if value in chunk and g["kind"] not in waveforms.kinds:
+                    selected.append(value)
+        self.plot_columns = list(dict.fromkeys(selected + ["_index"]))
+        # only pushed when a glyph draws from it
+        self.source_used = False
+        self.categories = []
+        self.downsampled = []
+        self.waveforms = []
+        self.waveform_info.text = ""
+        self.encoding = "exact" if any(g.get("encoding") == "exact" for g in self.template["glyphs"]) else None
+        self.stop_aggregations()
+        self.selection_columns = None
+        if not self.apply_cut():
+            return
+        glyphs = []
         sidx = 0
         for g in self.template["glyphs"]:
-            plot_func = getattr(fig, g["kind"])
             kwargs = copy(g["kwargs"])
+            categories = []
             for options in g["selector_options"].values():
                 selector = self.column_selectors[sidx]
                 sidx+=1
                 kwarg = options["kwarg"]
                 cats = options["catagories"]
-                if selector.value in df.columns:
+                if selector.value in chunk:
                     if cats is None:
                         kwargs[kwarg] = selector.value
                     else:
-                        if len(set(df[selector.value])) > len(cats):
-                            groups = pd.qcut(df[selector.value].values, len(cats), duplicates='drop')
-                        else:
-                            groups = pd.Categorical(df[selector.value])
-                        vals = [cats[xx] for xx in groups.codes]
-                        self.source.data["__{}".format(kwarg)] = vals
-                        kwargs[kwarg] =  "__{}".format(kwarg)
+                        mapping = self.category_mapping(self.current_name, selector.value, cats)
+                        categories.append((selector.value, "__{}".format(kwarg), mapping))
+                        kwargs[kwarg] = mapping.spec("__{}".format(kwarg))
                 elif kwarg in g["essential"]:
                     return
+            glyphs.append((g, kwargs, categories))
 
-            plot_func(**kwargs, source=self.source)
+        for g, kwargs, categories in glyphs:
+            if g["kind"] in aggregate.kinds:
+                self.build_aggregate(fig, g, kwargs)
+                continue
+            if g["kind"] in waveforms.kinds:
+                # one line for all rows, per row categories do not apply
+                line_kwargs = {k: v for k, v in kwargs.items() if k != "y" and not isinstance(v, dict)}
+                self.waveforms.append(waveforms.WaveformGlyph(fig, kwargs["y"], g.get("waveform", {}), **line_kwargs))
+                continue
+            plot_func = getattr(fig, g["kind"])
+            x, y = kwargs.get("x"), kwargs.get("y")
+            if self.selection_columns is None and x in self.plot_columns and y in self.plot_columns:
+                self.selection_columns = (x, y)
+            if "downsample" in g and x in self.plot_columns and y in self.plot_columns:
+                columns = self.chunk_columns(chunk, categories)
+                # default to the range of the whole source so other chunks fit in the view
+                schema = srcs.schema
+                if isinstance(fig.x_range, DataRange1d):
+                    fig.x_range = Range1d(*(pad_range(*schema.range(x)) if schema.range(x) else data_range(columns[x])))
+                if isinstance(fig.y_range, DataRange1d):
+                    fig.y_range = Range1d(*(pad_range(*schema.range(y)) if schema.range(y) else data_range(columns[y])))
+                source = ColumnDataSource()
+                glyph = DownsampledGlyph(self.shared_state["doc"], fig, source, columns, x, y, g["downsample"],
+                                         self.shared_state["executor"])
+                glyph.categories = categories
+                glyph.selection = self.current_selection()
+                glyph.update()
+                self.downsampled.append(glyph)
+            else:
+                source = self.source
+                self.source_used = True
+                self.categories.extend(categories)
+            plot_func(**kwargs, source=source)
+        if self.source_used:
+            self.source.data = source_data(self.chunk_columns(chunk, self.categories), srcs.schema, self.encoding)
+        elif self.source.data:
+            self.source.data = {}
+        self.show_waveforms(chunk)
+        fig.on_event(SelectionGeometry, self.selection_made)
+        fig.on_event(Reset, lambda event: self.shared_state["set_selection"](None))
+        self.highlight_selection()
         if len(self.plot_layout.children):
             self.plot_layout.children[0] = fig
         else:
             self.plot_layout.children.append(fig)
+        self.follow_load(idx)
+
+    def apply_cut(self):
+        '''
+        Set self.cut from the cut box and count the passing rows of the run
+        on the worker pool. Returns False if the expression is invalid.
+        '''
+        if self.cut_count is not None:
+            self.cut_count.set()
+            self.cut_count = None
+        text = self.cut_input.value.strip()
+        if not text:
+            self.cut = None
+            return True
+        sources = self.shared_state["sources"]
+        try:
+            name = self.define_column(self.current_name, text)
+        except (ExpressionError, KeyError) as e:
+            self.expression_status.text = "Invalid cut: {}".format(e)
+            return False
+        self.cut = Cut(name)
+        self.expression_status.text = "Cut {}: counting...".format(name)
+        cancel = self.cut_count = threading.Event()
+        srcs = sources[self.current_name]
+        def count():
+            return aggregate.aggregate_chunks(srcs, CutCount(self.cut), self.shared_state["data_layer"].aggregate_executor, cancel=cancel)
+        def counted(result):
+            if cancel.is_set():
+                return
+            if isinstance(result, Exception):
+                self.expression_status.text = "Invalid cut: {}".format(result)
+                return
+            self.expression_status.text = "Cut {}: {} of {} rows pass".format(name, result.passed, result.rows)
+        self.submit(counted, count)
+        return True
+
+    def selection_made(self, event):
+        if not event.final or self.selection_columns is None:
+            return
+        x, y = self.selection_columns
+        selection = Selection.from_geometry(self.current_name, x, y, event.geometry)
+        if selection is not None:
+            self.shared_state["set_selection"](selection)
+
+    def highlight_selection(self):
+        '''
+        Mark the rows of the plotted sources inside the current selection.
+        '''
+        selection = self.current_selection()
+        for glyph in self.downsampled:
+            glyph.selection = selection
+        data = self.source.data
+        if selection is None or selection.x not in data or selection.y not in data:
+            self.source.selected.indices = []
+            return
+        columns = {c: np.asarray(data[c]) for c in (selection.x, selection.y)}
+        self.source.selected.indices = np.flatnonzero(selection.mask(columns)).tolist()
+
+    def selection_changed(self, selection):
+        if self.selection_count is not None:
+            self.selection_count.set()
+            self.selection_count = None
+        self.highlight_selection()
+        for glyph in self.downsampled:
+            glyph.select()
+        if self.waveforms and self.current_name in self.shared_state["sources"]:
+            srcs = self.shared_state["sources"][self.current_name]
+            self.show_waveforms(srcs[self.current_position.value % len(srcs)])
+        if selection is None or selection.name not in self.shared_state["sources"]:
+            self.selection_info.text = ""
+            return
+        srcs = self.shared_state["sources"][selection.name]
+        self.selection_info.text = "Selected {}, counting rows...".format(selection)
+        # the selection is a cut on the columns, count it over every chunk of the run
+        cancel = self.selection_count = threading.Event()
+        def count():
+            selected = total = 0
+            for chunk in srcs:
+                if cancel.is_set():
+                    return None
+                if selection.applies_to(chunk):
+                    selected += int(selection.mask(chunk).sum())
+                total += len(chunk)
+            return selected, total
+        def counted(result):
+            if cancel.is_set() or result is None:
+                return
+            if isinstance(result, Exception):
+                print("failed to count the selection: {}".format(result))
+                return
+            self.selection_info.text = "Selected {}: {} of {} rows in {}".format(selection, result[0], result[1], selection.name)
+        self.submit(counted, count)
+
+    def stop_aggregations(self):
+        for cancel in self.aggregations:
+            cancel.set()
+        self.aggregations = []
+        self.aggregate_texts = {}
+        self.aggregate_info.text = ""
+
+    def build_aggregate(self, fig, g, kwargs):
+        '''
+        Histogram and summary statistics over all chunks of the current source.
+        Chunks are merged on the executor and the plot is redrawn as they come in.
+        '''
+        kwargs = copy(kwargs)
+        columns = [kwargs.pop(k) for k in ("x", "y") if k in kwargs]
+        bins = kwargs.pop("bins", 100)
+        value_range = kwargs.pop("range", None)
+        if g["kind"] == "hist2d":
+            bins = bins if isinstance(bins, list) else [bins, bins]
+            value_range = value_range or [None, None]
+        else:
+            bins, value_range = [bins], [value_range]
+        srcs = self.shared_state["sources"][self.current_name]
+        nchunks = len(srcs)
+        # without an explicit range, bin on the range of the source (or its first chunk for derived columns)
+        schema = srcs.schema
+        edges = [aggregate.edges_for(srcs[0][c], b, r or schema.range(c)) for c, b, r in zip(columns, bins, value_range)]
+        agg = aggregate.ColumnAggregate(columns, edges, cut=self.cut)
+        source = ColumnDataSource()
+        if g["kind"] == "hist":
+            fig.quad(top="top", bottom=0, left="left", right="right", source=source, **kwargs)
+        else:
+            mapper = LinearColorMapper(palette=Plasma256, nan_color=(0, 0, 0, 0))
+            fig.image(image="image", x="x", y="y", dw="dw", dh="dh", color_mapper=mapper, source=source, **kwargs)
+        cancel = threading.Event()
+        self.aggregations.append(cancel)
+        doc = self.shared_state["doc"]
+
+        def render(agg):
+            h = agg.histogram
+            if isinstance(h, aggregate.Histogram1D):
+                data = {"top": h.counts.copy(), "left": h.edges[:-1], "right": h.edges[1:]}
+                outside = "underflow={} overflow={}".format(h.underflow, h.overflow)
+            else:
+                counts = np.where(h.counts > 0, h.counts, np.nan).T
+                data = {"image": [counts], "x": [h.xedges[0]], "y": [h.yedges[0]],
+                        "dw": [h.xedges[-1]-h.xedges[0]], "dh": [h.yedges[-1]-h.yedges[0]]}
+                outside = "outside={}".format(h.outside)
+            text = "{} ({} of {} chunks, {})\n{}".format(g["name"], agg.chunks, nchunks, outside, agg.describe())
+            return data, text
+
+        def show(data, text):
+            if cancel.is_set():
+                return
+            source.data = data
+            self.aggregate_texts[g["name"]] = text
+            self.aggregate_info.text = "\n\n".join(self.aggregate_texts.values())
+
+        last = [0.]
+        def progress(agg):
+            # keep the document responsive on runs with many small chunks
+            if time.monotonic() - last[0] > 0.25:
+                last[0] = time.monotonic()
+                doc.add_next_tick_callback(partial(show, *render(agg)))
+
+        def run():
+            return aggregate.aggregate_chunks(srcs, agg, self.shared_state["data_layer"].aggregate_executor,
+                                              progress=progress, cancel=cancel)
+
+        def finished(result):
+            if isinstance(result, Exception):
+                print("failed to aggregate {}: {}".format(self.current_name, result))
+                return
+            show(*render(result))
+        self.submit(finished, run)
+
+    def follow_load(self, plotted):
+        '''
+        In live mode, append the rows of every other chunk of the plotted
+        source as it is loaded, without re-sending the rows already plotted.
+        '''
+        owner = "{}:plot".format(self.shared_state.get("session_id"))
+        if self.live_load is not None:
+            self.live_load.unsubscribe(owner)
+            self.live_load = None
+        if not self.live_toggle.active:
+            return
+        load = self.shared_state["data_layer"].get_load(self.current_name)
+        if load is None:
+            return
+        doc = self.shared_state["doc"]
+        self.live_load = load
+        self.live_chunks = {plotted}
+        load.subscribe(owner, lambda idx: doc.add_next_tick_callback(partial(self.live_chunk_arrived, load, idx)),
+                       lambda load: None)
+
+    def live_chunk_arrived(self, load, idx):
+        if load is not self.live_load or idx in self.live_chunks:
+            return
+        self.live_chunks.add(idx)
+        chunk = self.shared_state["sources"][load.name][idx]
+        for glyph in self.downsampled:
+            glyph.extend(self.chunk_columns(chunk, glyph.categories))
+        if self.source_used:
+            srcs = self.shared_state["sources"][load.name]
+            # streamed rows are appended to the arrays in the browser and must keep their dtypes
+            data = source_data(self.chunk_columns(chunk, self.categories), srcs.schema, self.encoding, like=self.source.data)
+            if data is not None:
+                self.source.stream(data)
+            else:
+                columns = [self.chunk_columns(srcs[i], self.categories) for i in sorted(self.live_chunks)]
+                self.source.data = source_data({n: np.concatenate([c[n] for c in columns]) for n in columns[0]},
+                                               srcs.schema, self.encoding)
+        self.current_position.end = len(self.shared_state["sources"][load.name])
 
     def build_plot_pane(self):
         def switch_table_source(name, idx):
@@ -397,9 +1093,18 @@ class PlotColumnsPage(Page):
                 self.current_name = name
                 new = idx%len(srcs)
                 self.current_position.end = len(srcs)
-                data = srcs[new]
                 self.current_position.value = new
-                self.source.stream(data, rollover=len(list(data.values())[0]))
+                if self.live_toggle.active:
+                    # showing a single chunk, stop following the load
+                    self.live_toggle.active = False
+                elif self.downsampled:
+                    # the downsampled view depends on the whole chunk, rebuild it
+                    self.build_plot()
+                elif self.plot_columns:
+                    if self.source_used:
+                        self.source.data = source_data(self.chunk_columns(srcs[new], self.categories), srcs.schema, self.encoding)
+                        self.highlight_selection()
+                    self.show_waveforms(srcs[new])
                 if new:
                     self.back_button.disabled = False
                 else:
@@ -426,10 +1131,15 @@ class PlotColumnsPage(Page):
             switch_table_source(self.current_name, new)
         self.current_position.on_change("value", position_changed)
 
+        def live_changed(attr, old, new):
+            if self.plot_columns is not None:
+                self.build_plot()
+        self.live_toggle.on_change("active", live_changed)
+
         buttons = row( widgetbox(self.back_button),
-            widgetbox( self.current_position), widgetbox(self.next_button), )
+            widgetbox( self.current_position), widgetbox(self.next_button), widgetbox(self.live_toggle, width=100))
         fig = figure(**self.figure_kwargs)
-        return column(fig, buttons)
+        return column(fig, buttons, self.selection_info, self.waveform_info, self.aggregate_info)
 
     def create_page(self):
         selection_bar = self.build_selection_bar()
@@ -437,9 +1147,15 @@ class PlotColumnsPage(Page):
         self.plot_layout = self.build_plot_pane()
         return row(selection_bar, self.plot_layout, width=self.width)
       
-    def update(self):
-        self.src_selector.options = [s for s in self.shared_state["sources"].keys()]
-        self.plot_template_selector.options = [t for t in self.shared_state["plot_templates"].keys()]
+    def refresh(self):
+        sources = self.shared_state["sources"].keys()
+        if sources != self.src_selector.options:
+            self.src_selector.options = sources
+            # a source that was removed may be loaded again with different data
+            self.category_mappings = {k: m for k, m in self.category_mappings.items() if k[0] in sources}
+        templates = list(self.shared_state["plot_templates"])
+        if templates != self.plot_template_selector.options:
+            self.plot_template_selector.options = templates
         # self.df_selector.value = self.shared_state["dataframe_names"][0]
 
 class StraxServerPage(Page):
@@ -454,33 +1170,57 @@ class StraxServerPage(Page):
         self.strax_config_source = ColumnDataSource({x:[] for x in strax_config_column_names})
         strax_config_columns = [TableColumn(field=name, title=name) for name in strax_config_column_names]
         self.strax_config_table = DataTable(source=self.strax_config_source, columns=strax_config_columns, width=1000, height=400)
+        self.strax_config_status = PreText(text="", width=1000, height=20)
+        self.cache_info_display = PreText(text="", width=1000, height=60)
 
     def create_page(self):
         def address_changed(attr, old, new):
             try:
-                ctx = self.shared_state.get('strax_ctx')
-                ctx.addr = self.address_selector.value
+                self.shared_state['strax_ctx'] = self.shared_state['data_layer'].client(new)
                 self.shared_state["update_pages"]()
             except:
                 self.address_selector.value = old
         self.address_selector.on_change('value', address_changed)
 
+        def show_config(name, df):
+            if name != self.strax_config_dataframe.value:
+                return
+            if isinstance(df, Exception):
+                self.strax_config_status.text = "Failed to load the config for {}: {}".format(name, df)
+                return
+            self.strax_config_status.text = "Config for {}".format(name)
+            data = df.to_dict(orient='list')
+            self.strax_config_table.columns = [TableColumn(field=name, title=name) for name in data]
+            self.strax_config_source.data = data
+
         def dataframe_changed(attr, old, new):
-            ctx = self.shared_state.get('strax_ctx')
-            try:
-                df = ctx.show_config(new)
-                data = df.to_dict(orient='list')
-                self.strax_config_table.columns = [TableColumn(field=name, title=name) for name in data]
-                self.strax_config_source.data = data
-            except:
-                pass
+            self.strax_config_status.text = "Loading the config for {}...".format(new)
+            self.metadata(partial(show_config, new), "show_config", new)
         self.strax_config_dataframe.on_change('value', dataframe_changed)
         self.strax_config_dataframe.value = self.strax_config_dataframe.options[0]
-        return column(widgetbox(self.address_selector), widgetbox(self.strax_config_dataframe), widgetbox(self.strax_config_table), width=self.width)
+        return column(widgetbox(self.address_selector), widgetbox(self.strax_config_dataframe),
+                      widgetbox(self.strax_config_status, width=1000), widgetbox(self.strax_config_table), widgetbox(self.cache_info_display), width=self.width)
+
+    def update_cache_info(self):
+        info = self.shared_state["sources"].info()
+        text = (
+            "Chunk cache: {:.1f} / {:.1f} MB ({policy}), {sources} sources, "
+            "{resident_chunks} chunks in memory, {evicted_chunks} evicted ({:.1f} MB spilled to disk)\n"
+            "Hit rate: {:.1%} ({hits} hits, {misses} reloads), {evictions} evictions"
+        ).format(info["nbytes"]/1e6, info["max_bytes"]/1e6, info["spilled_bytes"]/1e6, info["hit_rate"], **info)
+        disk_cache = self.shared_state["data_layer"].disk_cache
+        if disk_cache is not None:
+            disk = disk_cache.info()
+            text += "\nDisk cache: {:.1f} / {:.1f} MB, {} runs".format(disk["nbytes"]/1e6, disk["max_bytes"]/1e6, disk["runs"])
+        if text != self.cache_info_display.text:
+            self.cache_info_display.text = text
 
     def update(self):
         self.strax_config_dataframe.options = self.shared_state.get('dataframe_names')
 
+    def refresh(self):
+        self.update_cache_info()
+
 class PlotTemplatesPage(Page):
     title = 'Plot Templates'
 
@@ -505,8 +1245,35 @@ class PlotTemplatesPage(Page):
         selection = row(widgetbox(self.template_selector), widgetbox(self.build_plot_button))
         return column(selection ,widgetbox(self.json_viewer, width=self.width), width=self.width)
 
-    def update(self):
-        self.template_selector.options = [t for t in self.shared_state["plot_templates"].keys()]
+    def refresh(self):
+        templates = list(self.shared_state["plot_templates"])
+        if templates != self.template_selector.options:
+            self.template_selector.options = templates
         
 
-page_classes = [ExplorePage, LoadDataPage, PlotColumnsPage, StraxServerPage, PlotTemplatesPage]
\ No newline at end of file
+class MetricsPage(Page):
+    """
+    Timers, counters and gauges of this server process, see metrics.py.
+    """
+    title = "Metrics"
+
+    def init(self):
+        self.column_names = ["name", "labels", "type", "count", "mean", "max", "total"]
+        self.metrics_source = ColumnDataSource({n: [] for n in self.column_names})
+        columns = [TableColumn(field=n, title=n) for n in self.column_names]
+        self.metrics_table = DataTable(source=self.metrics_source, columns=columns, width=1000, height=600, editable=False)
+        self.help = PreText(text="Also served in the Prometheus text format at /metrics when started with serve.py",
+                            width=1000, height=20)
+
+    def create_page(self):
+        return column(widgetbox(self.help, width=1000), widgetbox(self.metrics_table, width=1000), width=self.width)
+
+    def refresh(self):
+        rows = metrics.registry.rows()
+        data = {n: ["" if r[n] is None else r[n] for r in rows] for n in self.column_names}
+        for n in ("mean", "max", "total"):
+            data[n] = ["" if v == "" else "{:.4g}".format(v) for v in data[n]]
+        if data != self.metrics_source.data:
+            self.metrics_source.data = data
+
+page_classes = [ExplorePage, LoadDataPage, PlotColumnsPage, StraxServerPage, MetricsPage, PlotTemplatesPage]
\ No newline at end of file
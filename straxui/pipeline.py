@@ -0,0 +1,213 @@
+"""
+Read-ahead pipeline for loading strax chunks.
+The chunk iterator (RPC transfer) is pulled in the calling thread while
+chunk preparation runs on a worker pool and finished chunks are handed
+to the consumer in order. At most `read_ahead` chunks are in flight
+between the RPC stream and the consumer acknowledging a chunk, so a slow
+consumer stalls the transfer instead of buffering without bound.
+Partial loads (a subset of the fields, a time window) are cut out of the
+stream by `select_arrays` before anything else touches the chunks.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numpy.lib.recfunctions import repack_fields
+from chunks import Chunk
+import metrics
+
+
+class LoadStats:
+    """
+    Throughput of a single load.
+    """
+    def __init__(self):
+        self.chunks = 0
+        self.rows = 0
+        self.nbytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return max(end - self.started, 1e-9)
+
+    @property
+    def chunks_per_s(self):
+        return self.chunks/self.elapsed
+
+    @property
+    def mb_per_s(self):
+        return self.nbytes/1e6/self.elapsed
+
+    def add(self, chunk):
+        self.chunks += 1
+        self.rows += len(chunk)
+        self.nbytes += chunk.array.nbytes
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def __str__(self):
+        return "{} chunks, {} rows, {:.1f} MB in {:.1f} s ({:.2f} chunks/s, {:.1f} MB/s)".format(
+            self.chunks, self.rows, self.nbytes/1e6, self.elapsed, self.chunks_per_s, self.mb_per_s)
+
+
+def prepare_chunk(arr):
+    '''
+    Wrap an array and summarize its columns.
+    '''
+    with metrics.timer("straxui_chunk_prepare_seconds"):
+        chunk = Chunk(arr)
+        chunk.schema
+    return chunk
+
+
+def close_stream(it):
+    '''
+    Stop a chunk stream early, grpc streams are cancelled, generators closed.
+    '''
+    for method in ("cancel", "close"):
+        if hasattr(it, method):
+            try:
+                getattr(it, method)()
+            except Exception:
+                pass
+            return
+
+
+def project(arr, fields):
+    '''
+    A compact copy of the given fields of a structured array, in the order of its dtype.
+    '''
+    missing = [f for f in fields if f not in arr.dtype.names]
+    if missing:
+        raise KeyError("no field {} in {}".format(", ".join(missing), ", ".join(arr.dtype.names)))
+    fields = [f for f in arr.dtype.names if f in fields]
+    if fields == list(arr.dtype.names):
+        return arr
+    # arr[fields] is a view with the full itemsize, repacking copies only the chosen fields
+    return repack_fields(arr[fields])
+
+
+def select_arrays(arrays, fields=None, seconds_range=None):
+    '''
+    Only the given fields of the rows in seconds_range, (start, stop) in
+    seconds since the first row of the run, of a time ordered chunk
+    stream. Chunks before the window are dropped and the stream is closed
+    as soon as a chunk starts after it. The time field is always kept.
+    '''
+    it = iter(arrays)
+    origin = None
+    try:
+        for arr in it:
+            if fields:
+                arr = project(arr, list(fields) + ["time"]*("time" in arr.dtype.names))
+            if seconds_range is not None and len(arr):
+                if origin is None:
+                    origin = int(arr["time"][0])
+                start, stop = seconds_range
+                lo = origin + int(start*1e9) if start is not None else None
+                hi = origin + int(stop*1e9) if stop is not None else None
+                if hi is not None and arr["time"][0] >= hi:
+                    metrics.count("straxui_partial_load_stops_total")
+                    return
+                if lo is not None and arr["time"][-1] < lo:
+                    metrics.count("straxui_partial_skipped_chunks_total")
+                    continue
+                keep = np.ones(len(arr), dtype=bool)
+                if lo is not None:
+                    keep &= arr["time"] >= lo
+                if hi is not None:
+                    keep &= arr["time"] < hi
+                if not keep.all():
+                    arr = arr[keep]
+            yield arr
+    finally:
+        # the rest of the run is not needed
+        close_stream(it)
+
+
+class FetchPipeline:
+    """
+    Runs loads with a shared pool of preparation workers.
+    """
+
+    def __init__(self, workers=4, read_ahead=4):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.read_ahead = read_ahead
+
+    @classmethod
+    def from_environ(cls):
+        return cls(workers=int(os.environ.get("STRAXUI_FETCH_WORKERS", 4)),
+                   read_ahead=int(os.environ.get("STRAXUI_READ_AHEAD", 4)))
+
+    def run(self, arrays, deliver, stats=None, cancel=None):
+        '''
+        Blocks until `arrays` is exhausted or the `cancel` event is set.
+        For every chunk, in order, calls deliver(idx, chunk, done) from a
+        helper thread; the consumer must call done() once it has taken
+        the chunk. Returns the LoadStats.
+        '''
+        if stats is None:
+            stats = LoadStats()
+        window = threading.Semaphore(self.read_ahead)
+        pending = queue.Queue()
+        failed = threading.Event()
+        cancel = cancel if cancel is not None else threading.Event()
+        errors = []
+
+        def halted():
+            return failed.is_set() or cancel.is_set()
+
+        def consume():
+            while True:
+                future = pending.get()
+                if future is None:
+                    return
+                if halted():
+                    continue
+                try:
+                    chunk = future.result()
+                    stats.add(chunk)
+                    deliver(stats.chunks-1, chunk, window.release)
+                except Exception as e:
+                    errors.append(e)
+                    failed.set()
+                    return
+
+        def acquire():
+            while not window.acquire(timeout=0.1):
+                if halted():
+                    return False
+            return not halted()
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        try:
+            it = iter(arrays)
+            while acquire():
+                try:
+                    # time spent waiting on the strax server (or the disk cache) per chunk
+                    with metrics.timer("straxui_rpc_seconds", method="get_array_iter"):
+                        arr = next(it)
+                except StopIteration:
+                    break
+                metrics.count("straxui_loaded_chunks_total")
+                metrics.count("straxui_loaded_bytes_total", arr.nbytes)
+                pending.put(self.pool.submit(prepare_chunk, arr))
+            if halted():
+                close_stream(it)
+        finally:
+            pending.put(None)
+            consumer.join()
+            stats.finish()
+        if errors:
+            raise errors[0]
+        return stats
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,131 @@
+"""
+Column index of a source, built once while its chunks are ingested.
+Every chunk is summarized on the fetch workers (dtype, row shape, range,
+distinct values while there are few) and the summaries are merged into the
+source schema, so pages pick selector options, table columns and default
+ranges without touching the data again.
+"""
+from copy import copy
+import numpy as np
+
+# distinct values are only tracked up to this cardinality
+max_distinct = 256
+
+
+class ColumnInfo:
+    """
+    Summary of one column over all chunks seen so far.
+    """
+
+    def __init__(self, name, kind, dtype=None, shape=(), derived=False):
+        self.name = name
+        self.kind = kind
+        self.dtype = dtype
+        self.shape = shape
+        self.derived = derived
+        self.min = None
+        self.max = None
+        self.distinct = None
+        self.rows = 0
+
+    @classmethod
+    def from_values(cls, name, values):
+        info = cls(name, "array" if values.ndim > 1 else "scalar", values.dtype.str, values.shape[1:])
+        info.rows = len(values)
+        if info.kind == "scalar" and values.dtype.kind in "biuf" and len(values):
+            finite = values[np.isfinite(values)] if values.dtype.kind == "f" else values
+            if len(finite):
+                info.min, info.max = finite.min().item(), finite.max().item()
+            # a short prefix rules out most high cardinality columns without sorting the chunk
+            distinct = np.unique(finite[:max_distinct*4])
+            if len(distinct) <= max_distinct and len(finite) > max_distinct*4:
+                distinct = np.unique(finite)
+            if len(distinct) <= max_distinct:
+                info.distinct = set(distinct.tolist())
+        return info
+
+    def merge(self, other):
+        if other.rows and (self.distinct is not None or not self.rows):
+            # still few distinct values, or none seen yet
+            if other.distinct is None:
+                self.distinct = None
+            else:
+                self.distinct = (self.distinct or set()) | other.distinct
+                if len(self.distinct) > max_distinct:
+                    self.distinct = None
+        self.rows += other.rows
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def numeric(self):
+        return self.min is not None
+
+    @property
+    def cardinality(self):
+        '''
+        Number of distinct values, None if there are more than max_distinct.
+        '''
+        return len(self.distinct) if self.distinct is not None else None
+
+    @property
+    def range(self):
+        return (self.min, self.max) if self.min is not None else None
+
+
+class SourceSchema:
+    """
+    Ordered ColumnInfo of all stored and derived columns of a source.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.fields = []
+        self.chunks = 0
+
+    @classmethod
+    def from_chunk(cls, chunk):
+        schema = cls()
+        schema.fields = list(chunk.fields)
+        schema.chunks = 1
+        for name, values in chunk.columns.items():
+            schema.columns[name] = ColumnInfo.from_values(name, values)
+        for name in chunk.derived:
+            if name in chunk.columns:
+                schema.columns[name].derived = True
+            else:
+                # not computed yet, its range is unknown until it is
+                schema.columns[name] = ColumnInfo(name, chunk.kind(name), derived=True)
+        return schema
+
+    def merge(self, other):
+        if not self.chunks:
+            self.fields = list(other.fields)
+        self.chunks += other.chunks
+        for name, info in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(info)
+            else:
+                self.columns[name] = copy(info)
+                if info.distinct is not None:
+                    self.columns[name].distinct = set(info.distinct)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def names(self, kind=None):
+        '''
+        Column names, optionally only "scalar" or "array" columns.
+        '''
+        return [n for n, info in self.columns.items() if kind is None or info.kind == kind]
+
+    def range(self, name):
+        info = self.columns.get(name)
+        return info.range if info is not None else None
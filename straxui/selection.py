@@ -0,0 +1,76 @@
+"""
+Server side selections made with the box and lasso select tools.
+The selection geometry sent by the browser is kept as a cut on the plotted
+(x, y) columns, so it can be evaluated as a boolean mask on any chunk of the
+run and not just on the points that were drawn.
+"""
+import numpy as np
+
+
+def points_in_polygon(x, y, px, py):
+    '''
+    Boolean mask of points inside the polygon (px, py), even-odd rule.
+    Points are sorted by y once, so each edge only tests the points
+    in its y band instead of all of them.
+    '''
+    order = np.argsort(y)
+    xs, ys = x[order], y[order]
+    inside = np.zeros(len(x), dtype=bool)
+    j = len(px) - 1
+    for i in range(len(px)):
+        # an edge crosses the horizontal ray of points with min(py) <= y < max(py)
+        lo, hi = np.searchsorted(ys, [min(py[i], py[j]), max(py[i], py[j])])
+        if hi > lo:
+            xcross = (px[j] - px[i])*(ys[lo:hi] - py[i])/(py[j] - py[i]) + px[i]
+            inside[lo:hi] ^= xs[lo:hi] < xcross
+        j = i
+    mask = np.empty(len(x), dtype=bool)
+    mask[order] = inside
+    return mask
+
+
+class Selection:
+    """
+    A rectangle or polygon in the (x, y) columns of a source.
+    """
+
+    def __init__(self, name, x, y, kind, xs, ys):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.kind = kind
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+
+    @classmethod
+    def from_geometry(cls, name, x, y, geometry):
+        '''
+        Selection from a bokeh SelectionGeometry event, None for unsupported tools.
+        '''
+        if geometry.get("type") == "rect":
+            return cls(name, x, y, "rect", [geometry["x0"], geometry["x1"]], [geometry["y0"], geometry["y1"]])
+        if geometry.get("type") == "poly" and len(geometry["x"]) > 2:
+            return cls(name, x, y, "poly", geometry["x"], geometry["y"])
+        return None
+
+    def applies_to(self, chunk):
+        return self.x in chunk and self.y in chunk and chunk.kind(self.x) == chunk.kind(self.y) == "scalar"
+
+    def mask(self, chunk):
+        '''
+        Boolean mask of the selected rows of a chunk.
+        '''
+        x, y = chunk[self.x], chunk[self.y]
+        mask = ((x >= self.xs.min()) & (x <= self.xs.max())
+                & (y >= self.ys.min()) & (y <= self.ys.max()))
+        if self.kind == "poly":
+            # the polygon test is only run on the points in its bounding box
+            rows = np.flatnonzero(mask)
+            mask[rows] = points_in_polygon(x[rows], y[rows], self.xs, self.ys)
+        return mask
+
+    def __str__(self):
+        if self.kind == "rect":
+            return "{} <= {} <= {}, {} <= {} <= {}".format(
+                self.xs.min(), self.x, self.xs.max(), self.ys.min(), self.y, self.ys.max())
+        return "({}, {}) in a lasso of {} points".format(self.x, self.y, len(self.xs))
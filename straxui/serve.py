@@ -0,0 +1,51 @@
+"""
+Run the app together with the tornado handlers that `bokeh serve` cannot add:
+
+    python straxui/serve.py --port 5006 --allow-websocket-origin localhost:5006
+
+The app is served at /straxui like with `bokeh serve straxui`, exports at /export
+and metrics in the Prometheus text format at /metrics. Websocket messages are
+compressed (permessage-deflate) when the browser supports it, see nginx.conf
+for running behind a proxy.
+"""
+import argparse
+from os.path import dirname, abspath
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.server.server import Server
+from bokeh.server.views.ws import WSHandler
+from export import ExportHandler
+from metrics import MetricsHandler
+
+
+def enable_websocket_compression(level):
+    '''
+    Offer permessage-deflate on the bokeh websocket, bokeh has no option for it.
+    '''
+    options = {"compression_level": level, "mem_level": 8}
+    WSHandler.get_compression_options = lambda self: options
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve straxui")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--address", default=None)
+    parser.add_argument("--allow-websocket-origin", action="append", default=None)
+    parser.add_argument("--websocket-compression", type=int, default=6,
+                        help="zlib level of websocket compression, 0 to turn it off")
+    args = parser.parse_args()
+
+    if args.websocket_compression > 0:
+        enable_websocket_compression(args.websocket_compression)
+
+    app = Application(DirectoryHandler(filename=dirname(abspath(__file__))))
+    server = Server({"/straxui": app}, port=args.port, address=args.address,
+                    allow_websocket_origin=args.allow_websocket_origin,
+                    extra_patterns=[(r"/export", ExportHandler), (r"/metrics", MetricsHandler)])
+    server.start()
+    print("straxui running at http://{}:{}/straxui".format(args.address or "localhost", args.port))
+    server.io_loop.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+from datalayer import get_data_layer, shutdown_data_layer
+import metrics
+
+
+def on_server_loaded(server_context):
+    '''
+    Create the data layer shared by all sessions before the first one connects.
+    '''
+    get_data_layer()
+
+def on_server_unloaded(server_context):
+    shutdown_data_layer()
+
+def on_session_destroyed(session_context):
+    '''
+    Stop loads that only the closed session was following.
+    '''
+    metrics.count("straxui_sessions_destroyed_total")
+    get_data_layer().release_session(session_context.id)
@@ -0,0 +1,115 @@
+"""
+Server side windowing for tables backed by cached chunks.
+Sorting and filtering are done on the numpy columns of the chunk and only
+the rows of the visible page are ever converted for the browser.
+"""
+import numpy as np
+import wire
+
+
+class TableView:
+    """
+    A sorted, filtered and paginated view of a single chunk.
+    """
+
+    def __init__(self, page_size=100):
+        self.page_size = page_size
+        self.chunk = None
+        self.sort_column = None
+        self.ascending = True
+        self.filters = {}
+        self.masks = {}
+        self._rows = None
+
+    def set_chunk(self, chunk):
+        self.chunk = chunk
+        self._rows = None
+
+    def sort(self, column, ascending=True):
+        self.sort_column = column
+        self.ascending = ascending
+        self._rows = None
+
+    def set_filter(self, column, low=None, high=None):
+        '''
+        Keep only rows with low <= column <= high, None bounds are open.
+        Setting both bounds to None removes the filter on that column.
+        '''
+        if low is None and high is None:
+            self.filters.pop(column, None)
+        else:
+            self.filters[column] = (low, high)
+        self._rows = None
+
+    def clear_filters(self):
+        self.filters = {}
+        self._rows = None
+
+    def set_mask(self, name, cut):
+        '''
+        Keep only rows where cut.mask(chunk) is True, e.g. a plot selection.
+        The cut is skipped for chunks where cut.applies_to(chunk) is False,
+        setting it to None removes it.
+        '''
+        if cut is None:
+            self.masks.pop(name, None)
+        else:
+            self.masks[name] = cut
+        self._rows = None
+
+    @property
+    def rows(self):
+        '''
+        Chunk row numbers in display order.
+        '''
+        if self._rows is None:
+            self._rows = self._compute_rows()
+        return self._rows
+
+    def _compute_rows(self):
+        if self.chunk is None:
+            return np.arange(0)
+        mask = np.ones(len(self.chunk), dtype=bool)
+        for column, (low, high) in self.filters.items():
+            if column not in self.chunk or self.chunk.kind(column) != "scalar":
+                continue
+            values = self.chunk[column]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        for cut in self.masks.values():
+            if cut.applies_to(self.chunk):
+                mask &= cut.mask(self.chunk)
+        rows = np.flatnonzero(mask)
+        if self.sort_column in self.chunk and self.chunk.kind(self.sort_column) == "scalar":
+            order = np.argsort(self.chunk[self.sort_column][rows], kind="mergesort")
+            if not self.ascending:
+                order = order[::-1]
+            rows = rows[order]
+        return rows
+
+    @property
+    def n_rows(self):
+        return len(self.rows)
+
+    @property
+    def n_pages(self):
+        return max(1, -(-self.n_rows // self.page_size))
+
+    def page(self, number, names):
+        '''
+        Returns ColumnDataSource data for the given page number.
+        '''
+        number = min(max(number, 0), self.n_pages-1)
+        start = number*self.page_size
+        rows = self.rows[start:start+self.page_size]
+        data = {}
+        for n in names:
+            if n not in self.chunk:
+                continue
+            col = self.chunk[n][rows]
+            data[n] = list(col) if col.ndim > 1 else col
+        # values shown as numbers must not lose precision, only integers are narrowed
+        mode = "off" if wire.default_mode() == "off" else "exact"
+        return wire.encode(data, "table", self.chunk.schema, mode)
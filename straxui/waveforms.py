@@ -0,0 +1,148 @@
+"""
+Waveform views of array fields like peak waveforms.
+multi_line needs one Python list per row, which is slow to build and to
+serialize for thousands of rows. Here the rows to draw are packed into one
+flat buffer with a NaN after every row and drawn as a single line glyph,
+which bokeh sends as a binary array. When there are more rows than
+`max_rows`, a density image of all rows is drawn underneath. Glyphs opt in
+from the plot template with the kind "waveform", e.g.
+
+    "waveform": {"max_rows": 500, "bins": 100, "length": "length", "dt": "dt"}
+
+`length` and `dt` name optional integer columns holding the number of
+valid samples and the sample width of every row, like in strax peaks.
+"""
+import numpy as np
+from bokeh.models import ColumnDataSource, LinearColorMapper
+from bokeh.core.property.validation import validate
+from bokeh.palettes import Plasma256
+from downsample import pad_range
+import wire
+
+kinds = ("waveform",)
+
+
+def row_lengths(values, lengths=None):
+    '''
+    Number of valid samples of every row, all of them without lengths.
+    '''
+    n, samples = values.shape
+    if lengths is None:
+        return np.full(n, samples, dtype=np.int64)
+    return np.clip(lengths, 0, samples).astype(np.int64)
+
+
+def valid_samples(values, lengths=None):
+    '''
+    Boolean (rows, samples) mask of the samples within the length of their row.
+    '''
+    lengths = row_lengths(values, lengths)
+    return np.arange(values.shape[1])[None, :] < lengths[:, None]
+
+
+def pack(values, lengths=None, dt=None, dtype=np.float32):
+    '''
+    Pack the rows of a 2-D field into flat (x, y, offsets) arrays, the valid
+    samples of every row followed by a NaN. Row i starts at offsets[i].
+    x is the sample number, or with dt the time since the start of the row.
+    '''
+    values = values.reshape(len(values), -1)
+    n, samples = values.shape
+    lengths = row_lengths(values, lengths)
+    # one extra column per row for the separator
+    keep = np.arange(samples + 1)[None, :] <= lengths[:, None]
+    y = np.empty((n, samples + 1), dtype=dtype)
+    y[:, :samples] = values
+    y[np.arange(n), lengths] = np.nan
+    x = np.broadcast_to(np.arange(samples + 1, dtype=dtype), (n, samples + 1))
+    if dt is not None:
+        x = x*np.asarray(dt, dtype=dtype)[:, None]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths + 1, out=offsets[1:])
+    return x[keep], y[keep], offsets
+
+
+def density(values, lengths=None, dt=None, bins=100):
+    '''
+    Counts of the valid samples of all rows on a (y, x) grid,
+    returns (counts, x_range, y_range).
+    '''
+    values = values.reshape(len(values), -1)
+    valid = valid_samples(values, lengths) & np.isfinite(values)
+    if not valid.any():
+        return np.zeros((bins, bins)), (0., 1.), (0., 1.)
+    x = np.arange(values.shape[1])
+    if dt is not None:
+        x = x*np.asarray(dt, dtype=np.int64)[:, None]
+    x_range = (0., float(np.max(x) + (np.max(dt) if dt is not None else 1)))
+    y_range = pad_range(float(np.min(values, where=valid, initial=np.inf)),
+                        float(np.max(values, where=valid, initial=-np.inf)), 0.)
+    # flat bin numbers on the whole 2-D field, invalid samples go to an extra bin
+    ix = np.minimum((x*(bins/x_range[1])).astype(np.int64), bins - 1)
+    with np.errstate(invalid="ignore"):
+        iy = np.minimum(((values - y_range[0])*(bins/(y_range[1] - y_range[0]))).astype(np.int64), bins - 1)
+    flat = np.where(valid, iy*bins + ix, bins*bins)
+    counts = np.bincount(flat.ravel(), minlength=bins*bins + 1)[:-1].reshape(bins, bins)
+    return counts, x_range, y_range
+
+
+class WaveformGlyph:
+    """
+    Draws rows of the array column `y` of a chunk as one packed line,
+    plus a density image of all rows when not every row can be drawn.
+    """
+
+    def __init__(self, fig, y, options, **kwargs):
+        self.y = y
+        self.max_rows = options.get("max_rows", 500)
+        self.bins = options.get("bins", 100)
+        self.length = options.get("length")
+        self.dt = options.get("dt")
+        self.rows = 0
+        self.shown = 0
+        self.line_source = ColumnDataSource({"x": [], "y": []})
+        self.image_source = ColumnDataSource({"image": [], "x": [], "y": [], "dw": [], "dh": []})
+        mapper = LinearColorMapper(palette=Plasma256, nan_color=(0, 0, 0, 0))
+        fig.image(image="image", x="x", y="y", dw="dw", dh="dh", color_mapper=mapper, source=self.image_source)
+        fig.line(x="x", y="y", source=self.line_source, **kwargs)
+
+    def integer_column(self, chunk, name):
+        '''
+        A scalar integer column used for lengths and sample widths, None if there is none.
+        '''
+        if name is None or name not in chunk or chunk.kind(name) != "scalar":
+            return None
+        values = chunk[name]
+        return values if values.dtype.kind in "iu" else None
+
+    def show(self, chunk, rows=None):
+        '''
+        Draw the given rows of a chunk (all by default), at most max_rows
+        of them evenly spread over the rows and the density of all of them.
+        '''
+        if rows is None:
+            rows = np.arange(len(chunk))
+        values = chunk[self.y].reshape(len(chunk), -1)
+        lengths = self.integer_column(chunk, self.length)
+        dt = self.integer_column(chunk, self.dt)
+        shown = rows
+        if len(rows) > self.max_rows:
+            shown = rows[np.linspace(0, len(rows) - 1, self.max_rows).astype(np.int64)]
+        x, y, _ = pack(values[shown], None if lengths is None else lengths[shown], None if dt is None else dt[shown])
+        image = {"image": [], "x": [], "y": [], "dw": [], "dh": []}
+        if len(rows) > len(shown):
+            counts, x_range, y_range = density(values[rows], None if lengths is None else lengths[rows],
+                                               None if dt is None else dt[rows], self.bins)
+            counts = np.where(counts > 0, np.log1p(counts), np.nan)
+            image = {"image": [counts], "x": [x_range[0]], "y": [y_range[0]],
+                     "dw": [x_range[1] - x_range[0]], "dh": [y_range[1] - y_range[0]]}
+        self.rows, self.shown = len(rows), len(shown)
+        # bokeh validates every pixel of an image given as a list of arrays, which is slower than the binning
+        with validate(False):
+            self.image_source.data = wire.encode(image, "image")
+        self.line_source.data = wire.encode({"x": x, "y": y}, "waveform")
+
+    def __str__(self):
+        if self.shown < self.rows:
+            return "{}: {} of {} rows drawn over their density".format(self.y, self.shown, self.rows)
+        return "{}: {} rows".format(self.y, self.rows)
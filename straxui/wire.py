@@ -0,0 +1,125 @@
+"""
+Compact encoding of ColumnDataSource data before it is pushed to the browser.
+Bokeh sends (u)int8/16/32 and float32/64 arrays as binary buffers but every
+other dtype, most importantly int64 and bool, as JSON lists. Columns are cast
+to the narrowest of those dtypes their range allows, taken from the source
+schema so every chunk of a source gets the same dtype. Set
+
+    STRAXUI_WIRE_ENCODING=compact   # default, also float64 -> float32 where it keeps the spacing
+    STRAXUI_WIRE_ENCODING=exact     # only lossless narrowing of integers
+    STRAXUI_WIRE_ENCODING=off
+
+A plot template glyph may ask for "encoding": "exact". Categories are
+already sent as small integer codes (see categories.py) and are narrowed
+like any other integer column.
+"""
+import os
+import numpy as np
+import metrics
+
+modes = ("compact", "exact", "off")
+
+_int_dtypes = [np.dtype(t) for t in (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32)]
+
+# float32 keeps about 7 digits, keep float64 for values far from zero compared to their spread
+max_float32_offset = 1e3
+
+
+def default_mode():
+    mode = os.environ.get("STRAXUI_WIRE_ENCODING", "compact")
+    return mode if mode in modes else "compact"
+
+
+def int_dtype(lo, hi):
+    '''
+    Narrowest binary integer dtype holding [lo, hi], None if there is none.
+    '''
+    for dtype in _int_dtypes:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return None
+
+
+def float32_ok(lo, hi):
+    magnitude = max(abs(lo), abs(hi))
+    if not np.isfinite(magnitude) or magnitude > 1e37:
+        return False
+    return hi == lo or magnitude/(hi - lo) < max_float32_offset
+
+
+def value_range(values, info=None):
+    if info is not None and info.range is not None:
+        return info.range
+    values = values[np.isfinite(values)] if values.dtype.kind == "f" else values
+    if not values.size:
+        return None
+    return values.min().item(), values.max().item()
+
+
+def encode_column(values, info=None, mode="compact"):
+    '''
+    The column cast to the dtype it is sent with, info is its schema.ColumnInfo if known.
+    '''
+    if mode == "off" or not isinstance(values, np.ndarray):
+        return values
+    kind = values.dtype.kind
+    if kind == "b" and mode == "compact":
+        return values.astype(np.uint8)
+    if kind in "iu":
+        bounds = value_range(values, info)
+        dtype = int_dtype(*bounds) if bounds is not None else np.dtype(np.int32)
+        if dtype is not None:
+            return values.astype(dtype) if dtype.itemsize < values.dtype.itemsize else values
+        # timestamps and the like, exact only as JSON
+        return values if mode == "exact" else values.astype(np.float64)
+    if kind == "f" and values.dtype.itemsize == 8 and mode == "compact":
+        bounds = value_range(values, info)
+        if bounds is None or float32_ok(*bounds):
+            return values.astype(np.float32)
+    return values
+
+
+def conform(values, dtype):
+    '''
+    Cast values to the dtype of a column already in the browser, None if they do not fit.
+    '''
+    if values.dtype == dtype or dtype.kind == "f":
+        return values.astype(dtype, copy=False)
+    if dtype.kind in "iu" and values.dtype.kind == "b":
+        # encode_column sends bools as uint8
+        return values.astype(dtype)
+    if dtype.kind in "iu" and values.dtype.kind in "iu":
+        bounds = value_range(values)
+        info = np.iinfo(dtype)
+        if bounds is None or info.min <= bounds[0] and bounds[1] <= info.max:
+            return values.astype(dtype)
+    return None
+
+
+def encode(data, kind, schema=None, mode=None, like=None):
+    '''
+    Encode ColumnDataSource data. Array columns (lists of rows) and image
+    lists are encoded element wise. With `like`, the data of the source it
+    will be streamed to, columns get the dtypes already sent and None is
+    returned if the values do not fit them.
+    '''
+    mode = mode or default_mode()
+    raw = metrics.data_nbytes(data)
+    encoded = {}
+    for name, values in data.items():
+        info = schema.columns.get(name) if schema is not None else None
+        previous = like.get(name) if like is not None else None
+        if isinstance(values, np.ndarray) and isinstance(previous, np.ndarray) and values.ndim == 1:
+            values = conform(values, previous.dtype)
+            if values is None:
+                return None
+        elif isinstance(values, np.ndarray) and values.ndim > 1:
+            values = list(encode_column(values, info, mode))
+        elif isinstance(values, list):
+            values = [encode_column(v, info, mode) for v in values]
+        else:
+            values = encode_column(values, info, mode)
+        encoded[name] = values
+    metrics.count("straxui_push_raw_bytes_total", raw, kind=kind)
+    return metrics.observe_push(encoded, kind)